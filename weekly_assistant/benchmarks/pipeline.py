@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the hot paths of --weekly and --daily.
+
+Generates a weekly note (configurable tasks per day, subtask nesting depth
+and completion ratio) and a week of calendar events served by the
+SyntheticCalendar stub from modules/simulation.py, so no network or Google
+account is involved. Each stage is timed a few times (best run wins) and
+measured once more under tracemalloc for its peak memory.
+
+Results are compared with benchmarks/baseline.json: a stage fails when its
+throughput drops, or its peak memory grows, by more than --threshold.
+Baselines are per machine and not committed: run once with --save-baseline
+first. Without a baseline the suite exits with 2.
+
+usage: python weekly_assistant/benchmarks/pipeline.py [--tasks-per-day 200] [--depth 2]
+                                                      [--completion 0.5] [--events 3000]
+                                                      [--repeat 5] [--threshold 0.25]
+                                                      [--save-baseline]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import argparse
+import contextlib
+import tracemalloc
+from datetime import datetime, timedelta
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from modules import clock, note_cache, rate_limit  # noqa: E402
+from modules.clock import FixedClock  # noqa: E402
+from modules.note_manager import week_context  # noqa: E402
+from modules.note_model import parse_note  # noqa: E402
+from modules.simulation import SyntheticCalendar  # noqa: E402
+from modules.task_processor import (  # noqa: E402
+    extract_pending_tasks, extract_future_tasks, update_note_with_tasks,
+    remove_tasks_from_note, add_calendar_events_to_day, index_event_tasks
+)
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# allowed slowdown (or memory growth) against the baseline before a stage fails
+REGRESSION_THRESHOLD = 0.25
+
+# the benchmark week: a Thursday, so the note has past and future days
+BENCH_DAY = datetime(2026, 10, 15, 5, 0)
+
+
+def generate_note(context, tasks_per_day=200, depth=2, completion=0.5, seed=0):
+    """
+    Build the markdown of a weekly note with tasks_per_day tasks per day,
+    subtasks nested up to depth levels and about completion of them checked.
+    """
+    rng = random.Random(seed)
+    lines = [
+        f"# This Week in {context.month_name} (Week {context.week_number}, {context.today.year})",
+        "",
+        "[[this-week|this week]]",
+        "#this-week",
+        ""
+    ]
+
+    for weekday, day_date in context.week_dates.items():
+        lines.append(f"### {weekday} ({day_date})")
+        for number in range(tasks_per_day):
+            checkbox = "- [x]" if rng.random() < completion else "- [ ]"
+            lines.append(f"{checkbox} {weekday} task {number} #{rng.randrange(50)}")
+            for level in range(1, rng.randrange(depth + 1) + 1):
+                lines.append(f"{'    ' * level}- [ ] subtask {level} of {number}")
+            if rng.random() < 0.05:
+                lines.append("")
+        lines.append("")
+
+    return "\n".join(lines) + "\n"
+
+
+def week_window(context, calendar):
+    """Return the (start, end) ISO timestamps of the benchmark week in the calendar timezone."""
+    monday = context.today - timedelta(days=context.today.weekday())
+    start = datetime.combine(monday, datetime.min.time()).astimezone(calendar.tz)
+    return start.isoformat(), (start + timedelta(days=7)).isoformat()
+
+
+def build_stages(context, note_content, calendar, cache_dir):
+    """
+    Return the stages as (name, unit, count, setup, run): setup builds fresh
+    input (not timed) and run(input) is the measured work.
+    """
+    from modules.calendar_sync import get_accepted_events, organize_events
+
+    # the stub generates the week once, later fetches only page through it
+    start, end = week_window(context, calendar)
+    events = list(get_accepted_events(calendar, start, end))
+    events_by_day = organize_events(events)
+
+    today = context.today
+    line_count = note_content.count("\n")
+    task_count = sum(len(section.tasks) for section in parse_note(note_content, today).sections)
+
+    empty_note = generate_note(context, tasks_per_day=1, depth=0)
+
+    def carried_over():
+        note = parse_note(note_content, today)
+        pending, future = extract_pending_tasks(note, today), extract_future_tasks(note, today)
+        return note, pending, future, parse_note(empty_note, today)
+
+    def merge_events(args):
+        note, events_by_day = args
+        event_index = index_event_tasks(note)
+        seen_events = set()
+        for section in note.sections:
+            add_calendar_events_to_day(section, events_by_day.get(section.weekday, []), event_index, seen_events)
+
+    # a note on disk with a warm cache entry, written an hour ago (a note
+    # written within the mtime resolution is still hashed on every read)
+    note_path = os.path.join(cache_dir, "note.md")
+    with open(note_path, "w", encoding="utf-8") as f:
+        f.write(note_content)
+    an_hour_ago = time.time() - 3600
+    os.utime(note_path, (an_hour_ago, an_hour_ago))
+    note_cache.read_note(note_path, today)
+
+    return [
+        ("parse_note", "lines", line_count,
+         lambda: None, lambda _: parse_note(note_content, today)),
+        ("read_note_cached", "lines", line_count,
+         lambda: None, lambda _: note_cache.read_note(note_path, today)),
+        ("render", "lines", line_count,
+         lambda: parse_note(note_content, today), lambda note: note.render()),
+        ("extract_tasks", "tasks", task_count,
+         lambda: parse_note(note_content, today),
+         lambda note: (extract_pending_tasks(note, today), extract_future_tasks(note, today))),
+        ("update_note_with_tasks", "tasks", task_count,
+         carried_over, lambda args: update_note_with_tasks(args[3], args[1], args[2])),
+        ("remove_tasks_from_note", "tasks", task_count,
+         carried_over, lambda args: remove_tasks_from_note(args[0], args[1], args[2], today)),
+        ("fetch_events", "events", len(events),
+         lambda: None, lambda _: list(get_accepted_events(calendar, start, end))),
+        ("fetch_events_local_recurrence", "events", len(events),
+         lambda: None, lambda _: list(get_accepted_events(calendar, start, end, local_recurrence=True))),
+        ("organize_events", "events", len(events),
+         lambda: None, lambda _: organize_events(events)),
+        ("add_calendar_events_to_day", "events", len(events),
+         lambda: (parse_note(note_content, today), events_by_day), merge_events),
+    ]
+
+
+def measure(setup, run, repeat):
+    """Return (best seconds, peak bytes) of run over repeat fresh inputs."""
+    best = float("inf")
+    for _ in range(repeat):
+        data = setup()
+        started = time.perf_counter()
+        run(data)
+        best = min(best, time.perf_counter() - started)
+
+    data = setup()
+    tracemalloc.start()
+    run(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def run_benchmarks(tasks_per_day, depth, completion, events_per_week, repeat):
+    """Run every stage and return {stage: {unit, count, seconds, throughput, peak_kb}}."""
+    previous_clock = clock.set_clock(FixedClock(BENCH_DAY))
+    # the stub has no quota, fetches are timed without the rate limiter's waits
+    previous_limiter = rate_limit.set_limiter(rate_limit.RateLimiter(rate=1e9, burst=10**9))
+    results = {}
+    cache_dir = None
+    try:
+        # the stages log every event they add, keep that out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            context = week_context()
+            note_content = generate_note(context, tasks_per_day, depth, completion)
+            calendar = SyntheticCalendar(meetings_per_week=events_per_week)
+            cache_dir = tempfile.mkdtemp(prefix="weekly-bench-")
+            previous_cache_dir = note_cache.set_cache_dir(cache_dir)
+            stages = build_stages(context, note_content, calendar, cache_dir)
+
+            for name, unit, count, setup, run in stages:
+                seconds, peak = measure(setup, run, repeat)
+                results[name] = {
+                    "unit": unit,
+                    "count": count,
+                    "seconds": seconds,
+                    "throughput": count / seconds if seconds else float("inf"),
+                    "peak_kb": peak / 1024
+                }
+    finally:
+        clock.set_clock(previous_clock)
+        rate_limit.set_limiter(previous_limiter)
+        if cache_dir:
+            note_cache.set_cache_dir(previous_cache_dir)
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    return results
+
+
+def compare_with_baseline(results, baseline, threshold):
+    """Return the list of stages that regressed beyond threshold."""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        if result["throughput"] < reference["throughput"] * (1 - threshold):
+            regressions.append(f"{name}: throughput {result['throughput']:.0f} < baseline {reference['throughput']:.0f} {result['unit']}/s")
+        if result["peak_kb"] > reference["peak_kb"] * (1 + threshold):
+            regressions.append(f"{name}: peak memory {result['peak_kb']:.0f} KB > baseline {reference['peak_kb']:.0f} KB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the note and calendar hot paths.")
+    parser.add_argument("--tasks-per-day", type=int, default=200, help="Tasks in each day section of the generated note")
+    parser.add_argument("--depth", type=int, default=2, help="Maximum subtask nesting depth")
+    parser.add_argument("--completion", type=float, default=0.5, help="Fraction of completed tasks")
+    parser.add_argument("--events", type=int, default=3000, help="Calendar events in the benchmark week")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per stage (best one counts)")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="Allowed regression against the baseline (0.25 = 25%%)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline results to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.tasks_per_day, args.depth, args.completion, args.events, args.repeat)
+
+    print(f"{'stage':<28} {'count':>7} {'time':>10} {'throughput':>18} {'peak':>10}")
+    for name, result in results.items():
+        print(
+            f"{name:<28} {result['count']:>7} {result['seconds'] * 1000:>8.2f}ms "
+            f"{result['throughput']:>11.0f} {result['unit'] + '/s':<6} {result['peak_kb']:>7.0f} KB"
+        )
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        # without a baseline nothing is checked, which must not pass for a green run
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one", file=sys.stderr)
+        return 2
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    regressions = compare_with_baseline(results, baseline, args.threshold)
+    for regression in regressions:
+        print(f"FAIL: {regression}")
+    if regressions:
+        return 1
+
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
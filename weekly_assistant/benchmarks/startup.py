@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Startup benchmark for the --weekly path.
+
+Imports modules.actions with `python -X importtime` a few times and fails
+when the cumulative import time goes over the budget, or when any of the
+heavy dependencies gets imported on the way. This covers startup only: a
+--weekly run still loads sqlite3 at its end, when the task index is refreshed.
+
+usage: python weekly_assistant/benchmarks/startup.py [--budget-ms 100] [--runs 5]
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+# cumulative import time allowed for modules.actions (median of all runs)
+STARTUP_BUDGET_MS = 100
+
+# modules that must not be loaded with modules.actions: the Google clients
+# (only --daily needs them) and sqlite3 (loaded once the notes are written)
+HEAVY_MODULES = ["googleapiclient", "google", "google_auth_oauthlib", "pytz", "sqlite3"]
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def measure_import_time():
+    """Import modules.actions in a fresh interpreter and return (milliseconds, imported modules)."""
+    code = "import sys, modules.actions; print(','.join(sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=APP_DIR, capture_output=True, text=True, check=True
+    )
+
+    # stderr lines look like "import time: self [us] | cumulative | imported package"
+    cumulative_us = 0
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == "modules.actions":
+            cumulative_us = int(fields[1])
+
+    return cumulative_us / 1000, set(result.stdout.strip().split(","))
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the --weekly startup budget.")
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS, help="Allowed import time in milliseconds")
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh interpreters to measure")
+    args = parser.parse_args()
+
+    timings = []
+    imported = set()
+    for _ in range(args.runs):
+        elapsed_ms, modules = measure_import_time()
+        timings.append(elapsed_ms)
+        imported |= modules
+
+    median_ms = sorted(timings)[len(timings) // 2]
+    heavy = sorted(
+        name for name in imported
+        if name.split(".")[0] in HEAVY_MODULES
+    )
+
+    print(f"modules.actions import time: median {median_ms:.1f} ms, best {min(timings):.1f} ms (budget {args.budget_ms:.0f} ms)")
+    if heavy:
+        print(f"FAIL: heavy modules imported on the --weekly path: {', '.join(heavy)}")
+        return 1
+    if median_ms > args.budget_ms:
+        print("FAIL: startup budget exceeded")
+        return 1
+
+    print("OK")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
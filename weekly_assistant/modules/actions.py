@@ -1,13 +1,17 @@
 #!/usr/bin/env python
 
-import os
 import argparse
 from pathlib import Path
-from datetime import datetime
-from modules.calendar_sync import sync_google_calendar
-from modules.note_manager import create_weekly_note, archive_weekly_note
+from datetime import timedelta
+from modules import instrument, note_cache
+from modules.calendar_window import load_window_week, set_timezone, DEFAULT_HORIZON_WEEKS, DEFAULT_TIMEZONE
+from modules.instrument import span
+from modules.note_manager import create_weekly_note, archive_weekly_note, week_context
 from modules.task_processor import process_weekly_tasks, update_daily_tasks
-from modules.utils import setup_paths
+from modules.manifest import current_note_path, rebuild_manifest
+from modules.concurrency import NoteMovedError, load_note
+from modules.storage import set_fsync_mode, flush_writes
+from modules.utils import setup_paths, log_action
 
 def main():
     """Main entry point for my weekly assistant."""
@@ -15,66 +19,262 @@ def main():
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument("--weekly", action="store_true", help="Process weekly notes - create new and archive old")
     group.add_argument("--daily", action="store_true", help="Update current weekly note with today's events")
+    group.add_argument("--query", metavar="TEXT", help="Search tasks in the inbox and archive notes")
+    group.add_argument("--rebuild-manifest", action="store_true", help="Rebuild the note manifest from the inbox and archive")
+    group.add_argument("--daemon", action="store_true", help="Keep running: watch the inbox and sync the calendar on a schedule")
+    group.add_argument("--expand-archive", action="store_true", help="Turn the archive packs made by --archive-pack back into plain note files")
+    group.add_argument("--simulate", nargs=2, metavar=("START", "END"), help="Replay the cron schedule between two dates (YYYY-MM-DD) against a synthetic calendar")
+    parser.add_argument("--incremental", action="store_true", help="Sync only calendar changes since the last run (daily mode)")
+    parser.add_argument("--local-recurrence", action="store_true", help="Fetch recurring events once as series and expand them locally (daily mode)")
+    parser.add_argument("--calendars", help="Comma-separated calendar ids to merge, or 'selected' for every selected calendar (daily mode)")
+    parser.add_argument("--status", choices=["all", "open", "done"], default="all", help="Filter --query results by task status")
+    parser.add_argument("--batch", metavar="CONFIG", help="Run --weekly or --daily for every vault listed in a JSON config")
+    parser.add_argument("--workers", type=int, help="Number of vaults processed in parallel (batch mode)")
+    parser.add_argument("--snapshot", action="store_true", help="Keep the synced week in calendar/snapshot.jsonl and log what changed since the last sync (daily mode)")
+    parser.add_argument("--horizon", type=int, default=DEFAULT_HORIZON_WEEKS, help="Weeks of calendar fetched by --daily; next week's events seed the note --weekly creates")
+    parser.add_argument("--archive-pack", choices=["month", "year"], help="Archive old notes into one zip pack per month or year instead of a file per week (weekly mode)")
+    parser.add_argument("--timezone", default=DEFAULT_TIMEZONE, help=f"IANA timezone events are shown in and weeks start in (default: {DEFAULT_TIMEZONE})")
+    parser.add_argument("--sync-interval", type=float, default=15, help="Minutes between calendar syncs (daemon mode)")
+    parser.add_argument("--fsync", choices=["off", "each", "batch"], default="batch", help="fsync note writes after each write, once per run (default) or never")
+    parser.add_argument("--log-json", action="store_true", help="Log JSON lines, with the duration and counts of each stage")
+    parser.add_argument("--profile", metavar="PATH", help="Run under cProfile and write the pstats dump to PATH")
     args = parser.parse_args()
 
+    if args.log_json:
+        instrument.enable()
+    set_fsync_mode(args.fsync)
+    try:
+        set_timezone(args.timezone)
+    except (KeyError, ValueError):
+        parser.error(f"unknown timezone: {args.timezone}")
+    if args.profile:
+        return instrument.run_profiled(run_command, args.profile, args)
+    return run_command(args)
+
+def run_command(args):
+    """Run the command selected on the command line."""
+
     # setup paths
     paths = setup_paths()
+    note_cache.set_cache_dir(paths["note_cache_dir"])
     
+    # queries only read the task index, no run log
+    if args.query:
+        return run_query(paths, args.query, args.status)
+    if args.rebuild_manifest:
+        rebuild_manifest(paths["inbox_dir"], paths["archive_dir"])
+        return 0
+    if args.expand_archive:
+        return run_expand_archive(paths)
+    if args.daemon:
+        from modules.daemon import run_daemon
+        run_daemon(paths, args.sync_interval, parse_calendars(args.calendars), args.horizon, args.local_recurrence,
+                   args.snapshot, args.archive_pack)
+        return 0
+    if args.simulate:
+        return run_simulate(*args.simulate, incremental=args.incremental, local_recurrence=args.local_recurrence,
+                            archive_pack=args.archive_pack)
+    if args.batch:
+        from modules.batch import run_batch
+        mode = "weekly" if args.weekly else "daily"
+        return run_batch(args.batch, mode, args.workers, args.incremental, args.local_recurrence, args.snapshot,
+                         args.archive_pack)
+
     # log execution start
-    now = datetime.now()
-    timestamp = now.strftime("%d/%m/%Y - %H:%M:%S")
-    print(f"[{timestamp}] running weekly assistant...")
+    log_action("running weekly assistant...")
 
     try:
         if args.weekly:
-            run_weekly_process(paths)
+            run_weekly_process(paths, archive_pack=args.archive_pack)
         elif args.daily:
-            run_daily_process(paths)
+            run_daily_process(paths, incremental=args.incremental, calendars=parse_calendars(args.calendars),
+                              horizon_weeks=args.horizon, local_recurrence=args.local_recurrence, snapshot=args.snapshot)
     except Exception as e:
-        print(f"[{timestamp}] Error: {e}")
+        # with --log-json the failing stage and the traceback are already in the span log
+        log_action(f"Error: {e}")
         return 1
     
-    print(f"[{timestamp}] weekly assistant completed successfully")
+    log_action("weekly assistant completed successfully")
     return 0
 
-def run_weekly_process(paths):
-    """Run the weekly process to create a new note and archive the old one."""
-    # find the current weekly note
-    current_weekly_note = find_current_weekly_note(paths["inbox_dir"])
-    
-    # create a new weekly note
-    new_note_path = create_weekly_note(paths["inbox_dir"])
+def run_weekly_process(paths, context=None, archive_pack=None):
+    """
+    Run the weekly process to create a new note and archive the old one
+    (into a monthly or yearly pack with archive_pack, see archive_weekly_note).
+    """
+    # everything about this week is computed once
+    if context is None:
+        context = week_context()
     
-    # process tasks from old note to new note (handles pending and future tasks)
-    process_weekly_tasks(current_weekly_note, new_note_path)
+    with span("weekly", week=context.week_key):
+        # find the current weekly note
+        with span("find_note"):
+            current_weekly_note = find_current_weekly_note(paths["inbox_dir"], paths["archive_dir"])
+        
+        # create a new weekly note, with this week's events already in it if
+        # the last --daily run fetched them
+        with span("create_note"):
+            monday = context.today - timedelta(days=context.today.weekday())
+            calendar_events = load_window_week(paths["calendar_window_path"], monday)
+            new_note_path = create_weekly_note(paths["inbox_dir"], context, calendar_events)
+        
+        # process tasks from old note to new note (handles pending and future tasks)
+        with span("carry_over"):
+            process_weekly_tasks(current_weekly_note, new_note_path, context.today)
+        
+        # archive the old weekly note
+        with span("archive_note"):
+            archive_weekly_note(current_weekly_note, paths["archive_dir"], archive_pack)
+
+        # make the notes durable before the index points to them
+        with span("fsync"):
+            flush_writes()
+
+        # keep the task index in sync with the notes we just wrote
+        with span("task_index"):
+            refresh_task_index(paths)
+
+def run_daily_process(paths, incremental=False, calendars=None, interactive=True, context=None, service=None,
+                      horizon_weeks=DEFAULT_HORIZON_WEEKS, local_recurrence=False, snapshot=False):
+    """
+    Run the daily process to update the current weekly note with calendar events.
+    With snapshot, the synced week is kept in paths["snapshot_path"].
+    The calendar sync (network) runs on a worker thread while the note is
+    found, read and parsed here; the two only meet to merge the events.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if context is None:
+        context = week_context()
     
-    # archive the old weekly note
-    archive_weekly_note(current_weekly_note, paths["archive_dir"])
-
-def run_daily_process(paths):
-    """Run the daily process to update the current weekly note with calendar events."""
-    # sync calendar events
-    calendar_events = sync_google_calendar(
-        paths["calendar_path"], 
-        paths["token_path"], 
-        paths["credentials_path"]
+    with span("daily", week=context.week_key, incremental=incremental):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            sync = executor.submit(
+                instrument.carry(fetch_calendar_events),
+                paths,
+                store_path=paths["event_store_path"] if incremental else None,
+                calendars=calendars,
+                interactive=interactive,
+                service=service,
+                horizon_weeks=horizon_weeks,
+                # a window of one week has nothing for --weekly to seed the next note from
+                window_path=paths["calendar_window_path"] if horizon_weeks > 1 else None,
+                local_recurrence=local_recurrence,
+                snapshot_path=paths["snapshot_path"] if snapshot else None,
+                # the week of the note the events go to, whatever day it already is in --timezone
+                week_start=context.today - timedelta(days=context.today.weekday())
+            )
+
+            # find and parse the current weekly note meanwhile
+            with span("find_note"):
+                weekly_note_path = find_current_weekly_note(paths["inbox_dir"], paths["archive_dir"])
+            with span("read_note"):
+                note = load_note(weekly_note_path, context.today)
+
+            # a failed sync raises here, before the note is touched
+            with span("wait_calendar"):
+                calendar_events = sync.result()
+        
+        # update the weekly note with calendar events
+        with span("merge_events"):
+            try:
+                update_daily_tasks(weekly_note_path, calendar_events, note=note, today=context.today)
+            except NoteMovedError:
+                # an overlapping --weekly run archived the note meanwhile, use the new one
+                weekly_note_path = find_current_weekly_note(paths["inbox_dir"], paths["archive_dir"])
+                update_daily_tasks(weekly_note_path, calendar_events, today=context.today)
+        
+        with span("fsync"):
+            flush_writes()
+
+        # keep the task index in sync with the notes we just wrote
+        with span("task_index"):
+            refresh_task_index(paths)
+
+def fetch_calendar_events(paths, **options):
+    """Sync the calendar and return this week's events organized by day (see sync_google_calendar)."""
+    # the Google client libraries are only needed here, so --weekly never pays for importing them
+    with span("import_client"):
+        from modules.calendar_sync import sync_google_calendar
+
+    with span("calendar_sync"):
+        return sync_google_calendar(paths["token_path"], paths["credentials_path"], **options)
+
+def run_simulate(start, end, incremental=False, local_recurrence=False, archive_pack=None):
+    """Run a simulation and print its report."""
+    import time
+    from modules.simulation import run_simulation, parse_date
+
+    started = time.perf_counter()
+    report = run_simulation(parse_date(start), parse_date(end), incremental=incremental, local_recurrence=local_recurrence,
+                            archive_pack=archive_pack)
+    elapsed = time.perf_counter() - started
+
+    print(
+        f"Simulated {report['days']} days ({report['weekly_runs']} weekly and {report['daily_runs']} daily runs, "
+        f"{report['api_requests']} API requests, {report['api_bytes'] / 1024:.0f} KiB of responses) in {elapsed:.2f}s"
     )
-    
-    # find current weekly note
-    weekly_note_path = find_current_weekly_note(paths["inbox_dir"])
-    
-    # update the weekly note with calendar events
-    update_daily_tasks(weekly_note_path, calendar_events)
-    
-    # clean up temporary files
-    if os.path.exists(paths["calendar_path"]):
-        os.remove(paths["calendar_path"])
-
-def find_current_weekly_note(inbox_dir):
-    """Find the current weekly note in the inbox directory."""
-    weekly_files = list(Path(inbox_dir).glob("*-week-*.md"))
-    if not weekly_files:
+    if report["api_failures"]:
+        print(
+            f"  {report['api_failures']} failed API calls, {report['api_retries']} retries, "
+            f"{report['throttled_seconds']:.0f}s throttled (simulated), {report['failed_daily_runs']} failed daily runs"
+        )
+    for violation in report["violations"]:
+        print(f"  violation: {violation}")
+    return 1 if report["violations"] else 0
+
+def run_expand_archive(paths):
+    """Expand the archive packs back to plain files and point the manifest and the task index at them."""
+    from modules.archive_pack import expand_packs
+
+    expanded = expand_packs(paths["archive_dir"])
+    flush_writes()
+    rebuild_manifest(paths["inbox_dir"], paths["archive_dir"])
+    refresh_task_index(paths)
+    log_action(f"Expanded {len(expanded)} archived notes")
+    return 0
+
+def run_query(paths, text, status="all"):
+    """Print the indexed tasks mentioning text."""
+    from modules.task_index import query_tasks
+
+    refresh_task_index(paths)
+    results = query_tasks(paths["index_path"], text, status)
+    if not results:
+        print(f"No tasks found for '{text}'")
+        return 0
+
+    for result in results:
+        checkbox = "[x]" if result["completed"] else "[ ]"
+        print(f"- {checkbox} {result['task']}")
+        print(f"      {result['weeks']} week(s), {result['first_day']} to {result['last_day']}, last in {result['path']}")
+    return 0
+
+def refresh_task_index(paths):
+    """Update the task index; a failure here never fails the run itself."""
+    from modules.task_index import update_task_index
+
+    try:
+        update_task_index(paths["index_path"], [paths["inbox_dir"], paths["archive_dir"]])
+    except Exception as e:
+        log_action(f"Could not update the task index: {e}")
+
+def find_current_weekly_note(inbox_dir, archive_dir=None):
+    """Find the current weekly note in the inbox directory (through the note manifest)."""
+    note_path = current_note_path(inbox_dir)
+    if note_path is None:
+        # first run, or the manifest was removed or points to a missing note
+        log_action("Note manifest missing or stale, rebuilding it")
+        rebuild_manifest(inbox_dir, archive_dir)
+        note_path = current_note_path(inbox_dir)
+
+    if note_path is None:
         raise FileNotFoundError("No weekly note found in the specified directory.")
     
-    # return the most recent weekly note
-    return sorted(weekly_files)[-1]
+    return Path(note_path)
+
+def parse_calendars(value):
+    """Parse the --calendars option into a list of calendar ids (or 'selected')."""
+    if not value or value == "selected":
+        return value
+    return [calendar_id.strip() for calendar_id in value.split(",") if calendar_id.strip()]
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+import io
+import os
+import time
+import zipfile
+from pathlib import Path
+from contextlib import nullcontext
+from fnmatch import fnmatch
+from functools import partial
+from datetime import date
+from modules.concurrency import directory_lock
+from modules.storage import atomic_write
+from modules.utils import log_action
+
+# how archived notes are grouped: one pack per month or per year (None keeps plain files)
+PACK_MODES = ("month", "year")
+
+PACK_PREFIX = "notes-"
+PACK_GLOB = f"{PACK_PREFIX}*.zip"
+
+WEEKLY_NOTE_GLOB = "*-week-*.md"
+
+
+def pack_path(archive_dir, week_key, mode):
+    """Return the pack a note of week_key ("YYYY-Www") goes to, by the month or year of its Monday."""
+    if mode not in PACK_MODES:
+        raise ValueError(f"Unknown archive pack mode: {mode}")
+    year, week = week_key.split("-W")
+    monday = date.fromisocalendar(int(year), int(week), 1)
+    name = f"{monday:%Y-%m}" if mode == "month" else f"{monday:%Y}"
+    return Path(archive_dir) / f"{PACK_PREFIX}{name}.zip"
+
+
+def packed_path(pack, name):
+    """The path a packed note is known by (manifest, task index): the pack path plus the member name."""
+    return str(Path(pack) / name)
+
+
+def split_packed_path(path):
+    """Return the (pack path, member name) of a packed note path, or None for a plain file."""
+    path = Path(path)
+    if not fnmatch(path.parent.name, PACK_GLOB):
+        return None
+    return path.parent, path.name
+
+
+def pack_note(note_path, pack):
+    """
+    Move a note into a pack. The pack is replaced atomically, so a crash
+    leaves either the old or the new pack; the note is removed only once it's
+    in. Both happen under the inbox lock, like a plain move.
+    Returns the packed path of the note.
+    """
+    note_path = Path(note_path)
+    pack = Path(pack)
+    # the same directory can't be locked twice (flock would wait for ourselves)
+    archive_lock = directory_lock(pack.parent) if pack.parent != note_path.parent else nullcontext()
+    with directory_lock(note_path.parent), archive_lock:
+        info = zipfile.ZipInfo.from_file(note_path, note_path.name)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        write_pack(pack, {info.filename: (info, note_path.read_bytes())})
+        os.remove(note_path)
+    return packed_path(pack, note_path.name)
+
+
+def write_pack(pack, members):
+    """
+    Replace pack with its current members plus members ({name: (ZipInfo, data)},
+    which win over current members of the same name). Packs hold a month or a
+    year of notes, so the new one is built in memory and written atomically.
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as new_pack:
+        if pack.exists():
+            with zipfile.ZipFile(pack) as old_pack:
+                for info in old_pack.infolist():
+                    if info.filename not in members:
+                        new_pack.writestr(info, old_pack.read(info))
+        for info, data in members.values():
+            new_pack.writestr(info, data)
+    atomic_write(pack, buffer.getvalue())
+
+
+def read_packed_note(path):
+    """
+    Read one packed note without unpacking the rest: the zip central directory
+    is the index, it gives the offset of the member to decompress.
+    """
+    pack, name = split_packed_path(path)
+    with zipfile.ZipFile(pack) as archive:
+        return archive.read(name).decode("utf-8")
+
+
+def scan_packs(note_dir):
+    """
+    Yield (packed path, signature, read) for every note packed in note_dir;
+    read() returns the note's text. The signature is (CRC, size) of the member,
+    it doesn't change when other notes are added to the pack.
+    """
+    for pack in sorted(Path(note_dir).glob(PACK_GLOB)):
+        try:
+            with zipfile.ZipFile(pack) as archive:
+                for info in archive.infolist():
+                    if fnmatch(info.filename, WEEKLY_NOTE_GLOB):
+                        read = partial(read_member, archive, info)
+                        yield packed_path(pack, info.filename), (info.CRC, info.file_size), read
+        except (OSError, zipfile.BadZipFile) as e:
+            log_action(f"Skipping unreadable archive pack {pack}: {e}")
+
+
+def read_member(archive, info):
+    return archive.read(info).decode("utf-8")
+
+
+def expand_packs(archive_dir):
+    """Turn every pack in archive_dir back into plain note files (with their mtimes) and remove it."""
+    expanded = []
+    archive_dir = Path(archive_dir)
+    with directory_lock(archive_dir):
+        for pack in sorted(archive_dir.glob(PACK_GLOB)):
+            with zipfile.ZipFile(pack) as archive:
+                for info in archive.infolist():
+                    note_path = archive_dir / Path(info.filename).name
+                    atomic_write(note_path, archive.read(info).decode("utf-8"))
+                    mtime = time.mktime(info.date_time + (0, 0, -1))
+                    os.utime(note_path, (mtime, mtime))
+                    expanded.append(note_path)
+            os.remove(pack)
+            log_action(f"Expanded {pack}")
+    return expanded
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+import os
+import json
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from modules import note_cache, rate_limit
+from modules.calendar_window import set_timezone, DEFAULT_HORIZON_WEEKS
+from modules.utils import setup_paths, log_action
+
+def run_batch(config_path, mode, workers=None, incremental=False, local_recurrence=False, snapshot=False,
+              archive_pack=None):
+    """
+    Run the weekly or daily process for every vault of a batch config on a
+    process pool. A failing vault never stops the others; a summary report is
+    printed at the end. Returns 1 if any vault failed, 0 otherwise.
+
+    Every Calendar API call of every worker goes through one shared rate
+    limiter ("api_rate" calls per second, bursts of "api_burst"), which slows
+    down for everyone when Google reports quota errors.
+
+    The config is a JSON file like:
+    {
+        "workers": 4,
+        "api_rate": 10,
+        "vaults": [
+            {"name": "felipe", "inbox_dir": "...", "archive_dir": "...",
+             "token_path": "...", "calendars": "selected", "incremental": true,
+             "local_recurrence": true, "snapshot": false, "timezone": "Europe/Lisbon",
+             "archive_pack": "year"}
+        ]
+    }
+    """
+    with open(config_path, encoding="utf-8") as f:
+        config = json.load(f)
+
+    vaults = config.get("vaults") or []
+    if not vaults:
+        log_action(f"No vaults in {config_path}, nothing to run")
+        return 0
+
+    # a vault that can't run is reported as failed without taking a worker
+    results = []
+    runnable = []
+    for vault in vaults:
+        problem = check_vault(vault)
+        if problem:
+            results.append(error_result(vault, problem))
+        else:
+            runnable.append(vault)
+
+    workers = max(1, workers or config.get("workers") or min(len(runnable), os.cpu_count() or 1))
+
+    # import the Google client once here, forked workers inherit it already loaded
+    if mode == "daily":
+        import modules.calendar_sync  # noqa: F401
+
+    log_action(f"Running {mode} batch for {len(vaults)} vaults with {workers} workers")
+    started = time.perf_counter()
+
+    context = multiprocessing.get_context("fork")
+    # created before the workers fork, so they all share its (shared memory) state
+    rate_limit.set_limiter(rate_limit.RateLimiter(
+        config.get("api_rate", rate_limit.DEFAULT_RATE),
+        config.get("api_burst", rate_limit.DEFAULT_BURST),
+        context=context
+    ))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {
+            pool.submit(run_vault, vault, mode, incremental, local_recurrence, snapshot, archive_pack): vault
+            for vault in runnable
+        }
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                # the worker itself died (killed, out of memory): BrokenProcessPool for its vault and the queued ones
+                results.append(error_result(futures[future], f"{type(e).__name__}: {e}"))
+
+    print_batch_report(results, time.perf_counter() - started)
+    return 0 if all(result["status"] == "ok" for result in results) else 1
+
+
+def run_vault(vault, mode, incremental=False, local_recurrence=False, snapshot=False, archive_pack=None):
+    """Run one vault and report how it went; errors stay inside this vault."""
+    from modules.actions import run_weekly_process, run_daily_process, parse_calendars
+
+    started = time.perf_counter()
+    api_before = rate_limit.metrics()
+    previous_timezone = None
+    try:
+        # a vault's own timezone only lasts for that vault, workers run several
+        if vault.get("timezone"):
+            previous_timezone = set_timezone(vault["timezone"])
+        paths = setup_paths(vault)
+        note_cache.set_cache_dir(paths["note_cache_dir"])
+        if mode == "weekly":
+            run_weekly_process(paths, archive_pack=vault.get("archive_pack", archive_pack))
+        else:
+            calendars = vault.get("calendars")
+            run_daily_process(
+                paths,
+                incremental=vault.get("incremental", incremental),
+                calendars=parse_calendars(calendars) if isinstance(calendars, str) else calendars,
+                interactive=False,
+                horizon_weeks=vault.get("horizon_weeks", DEFAULT_HORIZON_WEEKS),
+                local_recurrence=vault.get("local_recurrence", local_recurrence),
+                snapshot=vault.get("snapshot", snapshot)
+            )
+        status, error = "ok", None
+    except Exception as e:
+        status, error = "error", f"{type(e).__name__}: {e}"
+    if previous_timezone:
+        set_timezone(previous_timezone)
+
+    api_after = rate_limit.metrics()
+    return {
+        "vault": vault["name"],
+        "status": status,
+        "error": error,
+        "seconds": time.perf_counter() - started,
+        **{key: api_after[key] - api_before[key] for key in api_after}
+    }
+
+
+def check_vault(vault):
+    """Return why a vault of the config can't run, or None if it can."""
+    missing = [key for key in ("name", "inbox_dir", "archive_dir") if not vault.get(key)]
+    if missing:
+        return f"missing {', '.join(missing)} in the vault config"
+    if not os.path.isdir(vault["inbox_dir"]):
+        return f"inbox_dir {vault['inbox_dir']} is not a directory"
+    return None
+
+
+def error_result(vault, error, seconds=0.0):
+    """The report entry of a vault that failed outside run_vault."""
+    return {
+        "vault": vault.get("name") or "?",
+        "status": "error",
+        "error": error,
+        "seconds": seconds,
+        **{key: 0 for key in rate_limit.metrics()}
+    }
+
+
+def print_batch_report(results, elapsed):
+    """Print one line per vault and the totals."""
+    failed = [result for result in results if result["status"] != "ok"]
+
+    print(f"{'vault':<24} {'status':<6} {'time':>8} {'calls':>6} {'retries':>7} {'throttled':>9}  error")
+    for result in sorted(results, key=lambda result: result["vault"]):
+        print(
+            f"{result['vault']:<24} {result['status']:<6} {result['seconds']:>7.2f}s {result['api_calls']:>6} "
+            f"{result['api_retries']:>7} {result['throttled_seconds']:>8.2f}s  {result['error'] or ''}"
+        )
+
+    calls = sum(result["api_calls"] for result in results)
+    log_action(
+        f"Batch finished in {elapsed:.2f}s: {len(results) - len(failed)} ok, {len(failed)} failed, "
+        f"{calls} API calls ({calls / elapsed if elapsed else 0:.1f}/s), "
+        f"{sum(result['api_retries'] for result in results)} retries, "
+        f"{sum(result['throttled_seconds'] for result in results):.2f}s throttled"
+    )
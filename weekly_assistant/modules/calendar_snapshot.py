@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+import json
+from modules.storage import atomic_write
+from modules.utils import log_action
+
+# what a snapshot keeps of each event; an event counts as changed when any of these differ
+SNAPSHOT_FIELDS = ("id", "etag", "summary", "start", "end")
+
+
+def save_snapshot(snapshot_path, events_by_day):
+    """
+    Write the synced week (events organized by day) to snapshot_path as JSON
+    Lines, one event per line in day order, and log what changed since the
+    snapshot it replaces. Returns the records written.
+    """
+    previous = load_snapshot(snapshot_path)
+    records = [snapshot_record(day, event) for day, day_events in events_by_day.items() for event in day_events]
+    atomic_write(snapshot_path, "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+
+    if previous is not None:
+        added, changed, removed = diff_snapshots(previous, records)
+        log_action(f"Calendar snapshot: {len(added)} added, {len(changed)} changed, {len(removed)} removed since the last sync")
+    return records
+
+
+def load_snapshot(snapshot_path):
+    """Return the records of a snapshot, or None if there is none (or it can't be read)."""
+    try:
+        with open(snapshot_path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except (OSError, ValueError):
+        return None
+
+
+def snapshot_record(day, event):
+    """Turn a CalendarEvent into a JSON-friendly record."""
+    return {
+        "day": day,
+        "id": event.id,
+        "etag": event.etag,
+        "summary": event.summary,
+        "start": event.start.isoformat(),
+        "end": event.end.isoformat()
+    }
+
+
+def diff_snapshots(previous, current):
+    """
+    Compare two snapshots and return the (added, changed, removed) records;
+    changed holds the current version. Events are matched by id.
+    """
+    old = {record_key(record): record for record in previous}
+    new = {record_key(record): record for record in current}
+
+    added = [record for key, record in new.items() if key not in old]
+    removed = [record for key, record in old.items() if key not in new]
+    changed = [
+        record for key, record in new.items()
+        if key in old and any(old[key].get(field) != record.get(field) for field in SNAPSHOT_FIELDS)
+    ]
+    return added, changed, removed
+
+
+def record_key(record):
+    # events without an id (never the case for the API) are matched by title and start
+    if record.get("id"):
+        return record["id"]
+    return (record.get("summary"), record.get("start"))
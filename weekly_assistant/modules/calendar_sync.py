@@ -1,156 +1,535 @@
 #!/usr/bin/env python
 
 import os
+import fcntl
 import datetime
-import pytz
+from contextlib import contextmanager
 from pathlib import Path
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from google_auth_oauthlib.flow import InstalledAppFlow
+from modules import clock
+from modules.calendar_snapshot import save_snapshot
+from modules.calendar_window import organize_events, split_weeks, empty_week, save_window, local_zone
+from modules.instrument import span
+from modules.event_store import (
+    open_event_store, get_sync_token, reset_calendar, set_store_mode,
+    apply_event_changes, load_events, to_timestamp
+)
+from modules.rate_limit import call_api, is_retryable, retry_delay, pause, throttle, MAX_ATTEMPTS
+from modules.recurrence import expand_events
+from modules.utils import log_action
 
-def sync_google_calendar(calendar_path, token_path, credentials_path):
+# only the parts of an event resource that are actually used
+EVENT_FIELDS = "id,etag,status,summary,start,end,attendees(self,responseStatus)"
+PAGE_FIELDS = f"nextPageToken,nextSyncToken,items({EVENT_FIELDS})"
+
+# with local recurrence expansion: recurring events come with their rules,
+# exceptions with the instance they replace
+SERIES_EVENT_FIELDS = f"{EVENT_FIELDS},recurrence,recurringEventId,originalStartTime"
+SERIES_PAGE_FIELDS = f"nextPageToken,nextSyncToken,items({SERIES_EVENT_FIELDS})"
+
+# events per page (the API allows up to 2500), fewer pages means fewer round trips
+PAGE_SIZE = 2500
+
+# the API accepts at most 50 calls in a single batch request
+MAX_BATCH_SIZE = 50
+
+SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
+
+# refresh access tokens this long before they expire
+TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+# services built in this process, keyed by token path: (credentials, service)
+_service_cache = {}
+
+
+class CalendarFetchError(RuntimeError):
+    """Events could not be fetched (even after retrying); the note is left as it is."""
+
+
+def sync_google_calendar(token_path, credentials_path, store_path=None, calendars=None, interactive=True, service=None,
+                         horizon_weeks=1, window_path=None, local_recurrence=False, snapshot_path=None,
+                         week_start=None):
     """
     Syncs Google Calendar events for the current week and returns the events
-    organized by day.
+    organized by day (CalendarEvents, in the timezone set with
+    calendar_window.set_timezone).
+
+    The week is the one starting at week_start (a Monday date), which should be
+    the Monday of the note the events go to; it defaults to this week's Monday
+    on the clock the notes use (clock.today). Its days run from 00:00 to 00:00
+    in the configured timezone.
+
+    The fetch covers horizon_weeks weeks from that Monday in one paged request;
+    with window_path, the whole window is saved there so that --weekly can seed
+    next week's note from it (see calendar_window.load_window_week). With
+    snapshot_path, this week's events are also kept there as JSON Lines (see
+    calendar_snapshot.save_snapshot); by default nothing else is written.
+
+    With local_recurrence, recurring events are fetched once as series (their
+    rule plus the instances that were changed) and expanded here, instead of
+    Google sending every instance of every standing meeting on each fetch.
+
+    When store_path is given, events are synced incrementally with Google
+    sync tokens and kept in a local event store, so only changes are fetched.
+    calendars is a list of calendar ids, or "selected" for every calendar
+    selected in the user's calendar list (defaults to the primary calendar).
+    Without interactive, a missing or revoked token fails instead of opening
+    the browser consent flow. An already built service can be passed in.
     """
     # authenticate and get calendar service
-    service = authenticate_google_calendar(token_path, credentials_path)
-    
-    # get the current week's date range
-    tz = pytz.timezone('America/Sao_Paulo')
-    today = datetime.datetime.now(tz)
-    start_of_week = today - datetime.timedelta(days=today.weekday())
-    end_of_week = start_of_week + datetime.timedelta(days=6)
+    with span("auth"):
+        if service is None:
+            service = authenticate_google_calendar(token_path, credentials_path, interactive)
+        calendar_ids = resolve_calendar_ids(service, calendars)
     
-    # get accepted events for the week
-    accepted_events = get_accepted_events(
-        service, 
-        start_of_week.isoformat(), 
-        end_of_week.isoformat()
-    )
+    # get the week's date range
+    if week_start is None:
+        today = clock.today()
+        week_start = today - datetime.timedelta(days=today.weekday())
+    # the whole week, from Monday 00:00 to the next Monday 00:00, so that events
+    # already over today are still returned (and not mistaken for cancelled ones)
+    start_of_week = datetime.datetime.combine(week_start, datetime.time(0, 0), local_zone())
+    end_of_window = start_of_week + datetime.timedelta(weeks=max(1, horizon_weeks))
     
-    # organize events by day
-    events_by_day = organize_events(accepted_events)
+    # get accepted events for the whole window
+    with span("fetch_events", calendars=len(calendar_ids), weeks=horizon_weeks) as fetch_span:
+        if store_path:
+            accepted_events = get_accepted_events_incremental(
+                service,
+                store_path,
+                start_of_week.isoformat(),
+                end_of_window.isoformat(),
+                calendar_ids,
+                local_recurrence
+            )
+        elif calendar_ids != ['primary']:
+            accepted_events = get_accepted_events_batch(
+                service,
+                calendar_ids,
+                start_of_week.isoformat(),
+                end_of_window.isoformat(),
+                local_recurrence
+            )
+        else:
+            accepted_events = get_accepted_events(
+                service, 
+                start_of_week.isoformat(), 
+                end_of_window.isoformat(),
+                local_recurrence=local_recurrence
+            )
+        accepted_events = list(accepted_events)
+        fetch_span.count(events=len(accepted_events))
+
+    if window_path:
+        with span("save_window"):
+            save_window(window_path, accepted_events, start_of_week.isoformat(), end_of_window.isoformat())
+
+    # split the window into weeks and keep this one, organized by day
+    events_by_day = split_weeks(accepted_events).get(start_of_week.date(), empty_week())
     
-    # save events to markdown for reference
-    save_events_to_markdown(events_by_day, start_of_week, calendar_path)
+    if snapshot_path:
+        with span("save_snapshot"):
+            save_snapshot(snapshot_path, events_by_day)
     
     return events_by_day
 
 
-def authenticate_google_calendar(token_path, credentials_path):
-    """Authenticate with Google Calendar API and return service object."""
-    creds = None
-    
+def authenticate_google_calendar(token_path, credentials_path, interactive=True):
+    """
+    Authenticate with Google Calendar API and return service object.
+    The stored access token is reused until shortly before it expires and the
+    service is built from the discovery document bundled with the client, so
+    no extra HTTP calls happen before the events request.
+    """
+    # reuse the service built earlier in this process while its token is fresh
+    cached = _service_cache.get(token_path)
+    if cached and not needs_refresh(cached[0]):
+        return cached[1]
+
     # load existing credentials if available
-    if os.path.exists(token_path):
-        creds = Credentials.from_authorized_user_file(
-            token_path, ['https://www.googleapis.com/auth/calendar.readonly']
-        )
+    creds = load_credentials(token_path)
     
     # refresh or acquire new credentials if needed
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
+    if needs_refresh(creds):
+        creds = refresh_credentials(token_path, credentials_path, interactive)
+    
+    # build and return the service (static_discovery skips the discovery request)
+    service = build(
+        'calendar', 'v3', credentials=creds,
+        static_discovery=True, cache_discovery=False
+    )
+    _service_cache[token_path] = (creds, service)
+    return service
+
+
+def load_credentials(token_path):
+    """Load stored credentials, or return None if there are none yet."""
+    if not os.path.exists(token_path):
+        return None
+    return Credentials.from_authorized_user_file(token_path, SCOPES)
+
+
+def needs_refresh(creds):
+    """Check if credentials are missing or their access token expires within TOKEN_REFRESH_MARGIN."""
+    if not creds or not creds.token:
+        return True
+    if creds.expiry is None:
+        return False
+
+    # google-auth keeps expiry as a naive UTC datetime
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return creds.expiry - TOKEN_REFRESH_MARGIN <= now
+
+
+def refresh_credentials(token_path, credentials_path, interactive=True):
+    """
+    Refresh (or acquire) credentials while holding a lock on the token file,
+    so concurrent runs don't all hit the token endpoint at the same time.
+    """
+    with token_lock(token_path):
+        # another run may have refreshed the token while we waited for the lock
+        creds = load_credentials(token_path)
+        if not needs_refresh(creds):
+            return creds
+
+        if creds and creds.refresh_token:
             creds.refresh(Request())
+        elif not interactive:
+            raise RuntimeError(f"No usable token in {token_path}, authorize it with an interactive --daily run first")
         else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                credentials_path, ['https://www.googleapis.com/auth/calendar.readonly']
-            )
+            flow = InstalledAppFlow.from_client_secrets_file(credentials_path, SCOPES)
             creds = flow.run_local_server(port=0)
-            
-        # save credentials for future use
-        with open(token_path, 'w') as token:
+        
+        # save credentials for future use (atomically, other runs may be reading it)
+        tmp_path = f"{token_path}.tmp"
+        with open(tmp_path, 'w') as token:
             token.write(creds.to_json())
-    
-    # build and return the service
-    service = build('calendar', 'v3', credentials=creds)
-    return service
+        os.replace(tmp_path, token_path)
 
+    log_action("Refreshed Google Calendar credentials")
+    return creds
 
-def get_accepted_events(service, start_time, end_time):
-    """Get events from Google Calendar that the user has accepted."""
-    try:
-        # query calendar API
-        events_result = service.events().list(
-            calendarId='primary',
-            timeMin=start_time,
-            timeMax=end_time,
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
-        
-        # filter for accepted events
-        accepted_events = [
-            event for event in events_result.get('items', [])
-            if ('attendees' not in event or  # include events with no attendees
-                any(attendee.get('self', False) and 
-                    attendee.get('responseStatus') == 'accepted'
-                    for attendee in event.get('attendees', [])))
-        ]
-        
-        return accepted_events
-    except Exception as error:
-        print(f'An error occurred while fetching events: {error}')
-        return []
-
-
-def organize_events(events):
-    """Organize events by day of the week."""
-    br_tz = pytz.timezone('America/Sao_Paulo')
-    events_by_day = {
-        'Monday': [],
-        'Tuesday': [],
-        'Wednesday': [],
-        'Thursday': [],
-        'Friday': [],
-        'Saturday': [],
-        'Sunday': []
-    }
-    
+
+@contextmanager
+def token_lock(token_path):
+    """Hold an exclusive advisory lock next to the token file."""
+    with open(f"{token_path}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_accepted_events(service, start_time, end_time, page_size=PAGE_SIZE, local_recurrence=False):
+    """
+    Yield events from Google Calendar that the user has accepted.
+    Every result page is followed and events are filtered as pages arrive
+    (with local_recurrence, once all pages are in and the series are expanded).
+    Errors are raised once retries are spent: an empty week would strike
+    every event from the note.
+    """
+    pages = iter_event_pages(
+        service,
+        page_size,
+        fields=page_fields(local_recurrence),
+        calendarId='primary',
+        **events_query(start_time, end_time, local_recurrence)
+    )
+    events = (event for page in pages for event in page.get('items', []))
+    if local_recurrence:
+        events = expand_events(
+            list(events), start_time, end_time,
+            instance_fetcher(service, 'primary', start_time, end_time)
+        )
     for event in events:
-        # get start and end times
-        start_time = event['start'].get('dateTime', event['start'].get('date'))
-        end_time = event['end'].get('dateTime', event['end'].get('date'))
-        
-        # convert to datetime objects in local timezone
-        start_time = datetime.datetime.fromisoformat(start_time).astimezone(br_tz)
-        end_time = datetime.datetime.fromisoformat(end_time).astimezone(br_tz)
-        
-        # get day of week and add to appropriate list
-        day_of_week = start_time.strftime('%A')
-        
-        events_by_day[day_of_week].append({
-            'summary': event.get('summary', 'No Title'),
-            'start': start_time,
-            'end': end_time
-        })
-    
-    return events_by_day
+        if is_accepted_event(event):
+            yield event
 
 
-def save_events_to_markdown(events_by_day, week_start_date, output_path):
-    """Save events to a markdown file for reference."""
-    # calculate dates for each day of the week
-    week_dates = [
-        (week_start_date + datetime.timedelta(days=i)).date() 
-        for i in range(7)
+def get_accepted_events_batch(service, calendar_ids, start_time, end_time, local_recurrence=False):
+    """
+    Get accepted events from several calendars. The events.list calls of all
+    calendars are sent together as batch requests, so fetching N calendars
+    costs about one round trip (plus one per extra page) instead of N.
+    """
+    query = events_query(start_time, end_time, local_recurrence)
+    results = batch_event_pages(
+        service, {calendar_id: query for calendar_id in calendar_ids}, fields=page_fields(local_recurrence)
+    )
+
+    failed = {calendar_id: result['error'] for calendar_id, result in results.items() if result['error'] is not None}
+    if failed:
+        raise CalendarFetchError(
+            "Could not fetch events from " + ", ".join(f"{calendar_id} ({error})" for calendar_id, error in failed.items())
+        )
+
+    events_per_calendar = {}
+    for calendar_id, result in results.items():
+        events_per_calendar[calendar_id] = result['items']
+        if local_recurrence:
+            events_per_calendar[calendar_id] = expand_events(
+                result['items'], start_time, end_time,
+                instance_fetcher(service, calendar_id, start_time, end_time)
+            )
+
+    return merge_calendar_events(events_per_calendar)
+
+
+def get_accepted_events_incremental(service, store_path, start_time, end_time, calendar_ids=('primary',),
+                                    local_recurrence=False):
+    """
+    Get accepted events using an incremental sync against the local event store.
+    Only events changed since the last stored sync token are downloaded; an
+    expired token (HTTP 410) triggers a full resync of that calendar. With
+    local_recurrence the store keeps series, expanded each time they're loaded.
+    """
+    conn = open_event_store(store_path)
+    try:
+        if set_store_mode(conn, "series" if local_recurrence else "instances"):
+            log_action("Event store mode changed, running full resync")
+
+        try:
+            sync_event_store(service, conn, calendar_ids, start_time, local_recurrence)
+        except Exception as error:
+            # keep going with what we already have locally, unless a calendar was never synced
+            never_synced = [calendar_id for calendar_id in calendar_ids if get_sync_token(conn, calendar_id) is None]
+            if never_synced:
+                raise CalendarFetchError(f"Could not sync {', '.join(never_synced)}: {error}") from error
+            log_action(f"Could not sync the calendar ({error}), using the stored events")
+
+        events_per_calendar = {}
+        for calendar_id in calendar_ids:
+            events = load_events(conn, calendar_id, start_time, end_time)
+            if local_recurrence:
+                events = expand_events(
+                    events, start_time, end_time,
+                    instance_fetcher(service, calendar_id, start_time, end_time)
+                )
+            events_per_calendar[calendar_id] = events
+    finally:
+        conn.close()
+
+    return merge_calendar_events(events_per_calendar)
+
+
+def sync_event_store(service, conn, calendar_ids, time_min, local_recurrence=False):
+    """Fetch the changes of every calendar since its last sync and apply them to the store."""
+    fields = page_fields(local_recurrence)
+    queries = {
+        calendar_id: sync_query(get_sync_token(conn, calendar_id), time_min, local_recurrence)
+        for calendar_id in calendar_ids
+    }
+    results = batch_event_pages(service, queries, fields=fields)
+
+    # expired sync tokens need a full resync of their calendar
+    expired = [
+        calendar_id for calendar_id, result in results.items()
+        if isinstance(result['error'], HttpError) and result['error'].resp.status == 410
     ]
-    day_date_map = {d.strftime("%A"): d.strftime("%d/%m") for d in week_dates}
-    
-    # write to file
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(f"# Google Calendar Events ({week_start_date.strftime('%d/%m/%Y')})\n\n")
-        
-        for day, events in events_by_day.items():
-            date_str = day_date_map.get(day, '')
-            f.write(f"### {day} ({date_str})\n")
-            
-            for event in events:
-                start_time = event['start'].strftime('%H:%M')
-                end_time = event['end'].strftime('%H:%M')
-                f.write(f"{event['summary']} | {start_time} - {end_time}\n")
-            
-            f.write("\n")
-    
-    return output_path
+    if expired:
+        for calendar_id in expired:
+            log_action(f"Sync token expired for {calendar_id}, running full resync")
+            reset_calendar(conn, calendar_id)
+        results.update(batch_event_pages(
+            service,
+            {calendar_id: sync_query(None, time_min, local_recurrence) for calendar_id in expired},
+            fields=fields
+        ))
+
+    failed = []
+    for calendar_id, result in results.items():
+        if result['error'] is not None:
+            failed.append(f"{calendar_id} ({result['error']})")
+            continue
+
+        apply_event_changes(
+            conn, calendar_id, result['items'], result['sync_token'],
+            prune_before=to_timestamp(time_min)
+        )
+        log_action(f"Applied {len(result['items'])} calendar changes from {calendar_id}")
+
+    if failed:
+        raise CalendarFetchError(f"Could not sync {', '.join(failed)}")
+
+
+def sync_query(sync_token, time_min, local_recurrence=False):
+    """Build the events.list parameters of an incremental (or initial full) sync."""
+    single_events = not local_recurrence
+    if sync_token:
+        return {'syncToken': sync_token, 'singleEvents': single_events}
+    return {'timeMin': time_min, 'singleEvents': single_events}
+
+
+def events_query(start_time, end_time, local_recurrence=False):
+    """
+    Build the events.list parameters of a time window: every instance in
+    start order, or (local_recurrence) series and exceptions as stored.
+    """
+    if local_recurrence:
+        return {'timeMin': start_time, 'timeMax': end_time, 'singleEvents': False}
+    return {'timeMin': start_time, 'timeMax': end_time, 'singleEvents': True, 'orderBy': 'startTime'}
+
+
+def page_fields(local_recurrence=False):
+    return SERIES_PAGE_FIELDS if local_recurrence else PAGE_FIELDS
+
+
+def instance_fetcher(service, calendar_id, start_time, end_time):
+    """Return a function fetching the instances of a series Google has to expand (see expand_events)."""
+    def fetch_instances(master):
+        instances = []
+        page_token = None
+        while True:
+            page = call_api(service.events().instances(
+                calendarId=calendar_id,
+                eventId=master['id'],
+                timeMin=start_time,
+                timeMax=end_time,
+                pageToken=page_token,
+                maxResults=PAGE_SIZE,
+                fields=PAGE_FIELDS
+            ))
+            instances.extend(page.get('items', []))
+
+            page_token = page.get('nextPageToken')
+            if not page_token:
+                return instances
+    return fetch_instances
+
+
+def batch_event_pages(service, queries, page_size=PAGE_SIZE, fields=PAGE_FIELDS):
+    """
+    Run one events.list query per calendar and follow every page. Each round
+    of requests goes out as batch HTTP requests (up to MAX_BATCH_SIZE calls each).
+    Calls failing with a transient error are sent again in the next round,
+    after a backoff. Returns a dict mapping calendar ids to their items, last
+    sync token and error.
+    """
+    results = {
+        calendar_id: {'items': [], 'sync_token': None, 'error': None}
+        for calendar_id in queries
+    }
+    attempts = {calendar_id: 0 for calendar_id in queries}
+    page_tokens = {calendar_id: None for calendar_id in queries}
+
+    while page_tokens:
+        pending = list(page_tokens.items())
+        page_tokens = {}
+        delays = []
+
+        def collect(request_id, page, error):
+            calendar_id, page_token = pending[int(request_id)]
+            result = results[calendar_id]
+            if error is not None:
+                attempts[calendar_id] += 1
+                if is_retryable(error) and attempts[calendar_id] < MAX_ATTEMPTS:
+                    delays.append(retry_delay(error, attempts[calendar_id] - 1))
+                    page_tokens[calendar_id] = page_token
+                else:
+                    result['error'] = error
+                return
+
+            result['items'].extend(page.get('items', []))
+            result['sync_token'] = page.get('nextSyncToken', result['sync_token'])
+            if page.get('nextPageToken'):
+                page_tokens[calendar_id] = page['nextPageToken']
+
+        for chunk_start in range(0, len(pending), MAX_BATCH_SIZE):
+            batch = service.new_batch_http_request(callback=collect)
+            chunk = range(chunk_start, min(chunk_start + MAX_BATCH_SIZE, len(pending)))
+            for index in chunk:
+                calendar_id, page_token = pending[index]
+                batch.add(
+                    service.events().list(
+                        calendarId=calendar_id,
+                        pageToken=page_token,
+                        maxResults=page_size,
+                        fields=fields,
+                        **queries[calendar_id]
+                    ),
+                    request_id=str(index)
+                )
+            # every call in a batch counts against the quota
+            call_api(batch, calls=len(chunk))
+
+        if delays:
+            log_action(f"{len(delays)} calendar calls failed, retrying in {max(delays):.1f}s")
+            throttle(pause(max(delays)))
+
+    return results
+
+
+def merge_calendar_events(events_per_calendar):
+    """
+    Merge the events of several calendars into one list of accepted events.
+    A meeting that shows up in more than one calendar is only kept once.
+    """
+    merged = {}
+    for events in events_per_calendar.values():
+        for event in events:
+            if is_accepted_event(event):
+                merged.setdefault(event['id'], event)
+    return list(merged.values())
+
+
+def resolve_calendar_ids(service, calendars):
+    """Turn the calendars option into a list of calendar ids."""
+    if not calendars:
+        return ['primary']
+    if calendars == 'selected':
+        return get_selected_calendar_ids(service)
+    return list(calendars)
+
+
+def get_selected_calendar_ids(service):
+    """Return the ids of every calendar selected in the user's calendar list."""
+    calendar_ids = []
+    page_token = None
+    while True:
+        page = call_api(service.calendarList().list(
+            pageToken=page_token,
+            fields="nextPageToken,items(id,selected)"
+        ))
+        calendar_ids.extend(
+            item['id'] for item in page.get('items', []) if item.get('selected')
+        )
+
+        page_token = page.get('nextPageToken')
+        if not page_token:
+            return calendar_ids
+
+
+def iter_event_pages(service, page_size, fields=PAGE_FIELDS, **params):
+    """
+    Yield every page of an events.list query, requesting only the event
+    fields this tool uses (partial response).
+    """
+    page_token = None
+    while True:
+        page = call_api(service.events().list(
+            pageToken=page_token,
+            maxResults=page_size,
+            fields=fields,
+            **params
+        ))
+        yield page
+
+        page_token = page.get('nextPageToken')
+        if not page_token:
+            return
+
+
+def is_accepted_event(event):
+    """Check if an event has no attendees or was accepted by the user."""
+    if 'attendees' not in event:  # include events with no attendees
+        return True
+    return any(
+        attendee.get('self', False) and attendee.get('responseStatus') == 'accepted'
+        for attendee in event.get('attendees', [])
+    )
+
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+import json
+import datetime
+from dataclasses import dataclass
+from functools import lru_cache
+from operator import attrgetter
+from modules import clock
+from modules.storage import atomic_write
+from modules.utils import log_action
+
+# weeks fetched by --daily: this one and the next, so Monday's --weekly run
+# can seed the new note without going to the network
+DEFAULT_HORIZON_WEEKS = 2
+
+# a window older than this is not trusted to seed a new note
+WINDOW_MAX_AGE = datetime.timedelta(days=2)
+
+# events are placed on days (and shown) in this timezone, see set_timezone
+DEFAULT_TIMEZONE = "America/Sao_Paulo"
+
+# the day sections of a note, in datetime.weekday() order
+WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+_timezone = DEFAULT_TIMEZONE
+
+
+@dataclass(slots=True)
+class CalendarEvent:
+    """An accepted event, with its start and end in the local timezone."""
+    id: str
+    etag: str
+    summary: str
+    start: datetime.datetime
+    end: datetime.datetime
+
+
+def set_timezone(name):
+    """Use the IANA timezone name for events and the calendar week; returns the previous name."""
+    global _timezone
+    zone(name)  # fail here on an unknown name, not in the middle of a sync
+    previous, _timezone = _timezone, name
+    return previous
+
+
+def local_zone():
+    """Return the tzinfo of the configured timezone."""
+    return zone(_timezone)
+
+
+@lru_cache(maxsize=None)
+def zone(name):
+    from zoneinfo import ZoneInfo
+    return ZoneInfo(name)
+
+
+def save_window(window_path, events, start_time, end_time):
+    """Keep the accepted events of the fetched window (raw API resources) for later runs."""
+    window = {
+        "fetched_at": clock.now(datetime.timezone.utc).isoformat(),
+        "start": start_time,
+        "end": end_time,
+        "events": events
+    }
+    atomic_write(window_path, json.dumps(window, ensure_ascii=False))
+
+
+def load_window_week(window_path, week_start):
+    """
+    Return the events of the week starting at week_start (a date) organized by
+    day, from the saved window; None if the window is missing, stale or
+    doesn't cover that week.
+    """
+    try:
+        with open(window_path, encoding="utf-8") as f:
+            window = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    fetched_at = datetime.datetime.fromisoformat(window["fetched_at"])
+    if clock.now(datetime.timezone.utc) - fetched_at > WINDOW_MAX_AGE:
+        log_action(f"Calendar window from {fetched_at:%d/%m %H:%M} is too old to seed the note")
+        return None
+
+    start = datetime.datetime.fromisoformat(window["start"])
+    end = datetime.datetime.fromisoformat(window["end"])
+    if not (start.date() <= week_start and week_start + datetime.timedelta(days=7) <= end.date()):
+        return None
+
+    return split_weeks(window["events"]).get(week_start, empty_week())
+
+
+def split_weeks(events):
+    """Split events into weeks: {Monday date: events organized by day}."""
+    weeks = {}
+    for day_of_week, day_events in organize_events(events).items():
+        for event in day_events:
+            day = event.start.date()
+            week_start = day - datetime.timedelta(days=day.weekday())
+            weeks.setdefault(week_start, empty_week())[day_of_week].append(event)
+    return weeks
+
+
+def empty_week():
+    return {day: [] for day in WEEKDAYS}
+
+
+def organize_events(events, timezone=None):
+    """
+    Organize events (API resources) by day of the week, as CalendarEvents in
+    the local timezone (or timezone, an IANA name) sorted by start.
+    """
+    tz = zone(timezone) if timezone else local_zone()
+    parse = datetime.datetime.fromisoformat
+
+    # recurring events share their times, each distinct value is converted once
+    converted = {}
+
+    def local_time(event_time):
+        value = event_time.get('dateTime') or event_time['date']
+        moment = converted.get(value)
+        if moment is None:
+            if 'dateTime' in event_time:
+                moment = parse(value).astimezone(tz)
+            else:
+                # an all-day event starts at midnight wherever the note is, not where the host is
+                moment = datetime.datetime.combine(datetime.date.fromisoformat(value), datetime.time(), tz)
+            converted[value] = moment
+        return moment
+
+    calendar_events = [
+        CalendarEvent(
+            event.get('id'),
+            event.get('etag', ''),
+            event.get('summary', 'No Title'),
+            local_time(event['start']),
+            local_time(event['end'])
+        )
+        for event in events
+    ]
+    # events from different calendars arrive interleaved: sort once, then bucket by day in order
+    calendar_events.sort(key=attrgetter('start'))
+
+    days = [[] for _ in WEEKDAYS]
+    for event in calendar_events:
+        days[event.start.weekday()].append(event)
+    return dict(zip(WEEKDAYS, days))
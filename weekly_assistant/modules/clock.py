@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+from datetime import datetime, timedelta
+
+class SystemClock:
+    """The real wall clock."""
+
+    def now(self, tz=None):
+        return datetime.now(tz)
+
+
+class FixedClock:
+    """
+    A clock that stays at a naive local moment until it is moved.
+    Used to replay runs at any date (see modules/simulation.py).
+    """
+
+    def __init__(self, moment):
+        self.moment = moment
+
+    def now(self, tz=None):
+        return self.moment.astimezone(tz) if tz else self.moment
+
+    def set(self, moment):
+        self.moment = moment
+
+    def advance(self, **kwargs):
+        self.moment += timedelta(**kwargs)
+
+
+_clock = SystemClock()
+
+
+def now(tz=None):
+    """Return the current time of the active clock."""
+    return _clock.now(tz)
+
+
+def today():
+    """Return the current date of the active clock."""
+    return _clock.now().date()
+
+
+def set_clock(clock):
+    """Replace the active clock and return the previous one."""
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+import os
+import fcntl
+from pathlib import Path
+from contextlib import contextmanager
+from modules import note_cache
+from modules.note_model import Note, parse_note
+from modules.storage import read_versioned, write_if_changed, FileChangedError
+from modules.utils import log_action
+
+# advisory lock shared by our own processes, one per notes directory (a dotfile, Obsidian ignores it)
+LOCK_NAME = ".weekly-assistant.lock"
+
+# how many times a read-modify-write starts over when someone else changed the same section
+MAX_ATTEMPTS = 5
+
+
+class NoteConflictError(RuntimeError):
+    """The note was changed by someone else in the same section we changed."""
+
+
+class NoteMovedError(FileNotFoundError):
+    """The note was moved away (archived) while we were updating it."""
+
+
+@contextmanager
+def directory_lock(directory):
+    """Hold the advisory lock of a notes directory; only commits take it, and only briefly."""
+    lock_path = Path(directory) / LOCK_NAME
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def update_note(path, modify, today=None, note=None):
+    """
+    Read-modify-write a note without holding a lock while modify(note) runs.
+    The result is committed with commit_note; if someone changed the same
+    section in the meantime, modify runs again on their version. An already
+    parsed note can be passed in (its source is the version it was read as).
+    Returns the note, matching what is now on disk.
+    """
+    path = Path(path)
+    for _ in range(MAX_ATTEMPTS):
+        if note is None:
+            note = load_note(path, today)
+
+        modify(note)
+        content = note.render()
+        try:
+            written = commit_note(path, content, note.source, today)
+        except NoteConflictError:
+            log_action(f"{path} was edited in the same place meanwhile, updating it again")
+            note = None
+            continue
+
+        if written != content:
+            # other edits were merged in, keep the parsed note in step with the file
+            merged = parse_note(written, today)
+            note.header, note.sections = merged.header, merged.sections
+        note.source = written
+        note_cache.remember(path, note, written, today)
+        return note
+
+    raise NoteConflictError(f"{path} kept changing, gave up after {MAX_ATTEMPTS} attempts")
+
+
+def load_note(path, today=None):
+    """Parse a note from disk (through the note cache)."""
+    return note_cache.read_note(path, today)
+
+
+def commit_note(path, content, base, today=None):
+    """
+    Compare-and-swap a note: write content if the file still holds base (the
+    text our changes started from). If it changed, the changes are merged
+    section by section; NoteConflictError means both sides changed the same
+    section. The file is checked again (mtime and size) right before it's
+    replaced, so an editor saving in between makes us merge again instead of
+    overwriting it. Returns the text now in the file.
+    """
+    path = Path(path)
+    with directory_lock(path.parent):
+        while True:
+            current, signature = read_versioned(path)
+            if current is None and base is not None:
+                raise NoteMovedError(f"{path} was moved while it was being updated")
+
+            if current is None or base is None or current == base:
+                result = content
+            else:
+                result = merge_notes(base, content, current, today)
+                if result is None:
+                    raise NoteConflictError(f"{path} was changed in the same section meanwhile")
+                log_action(f"{path} was edited meanwhile, merged the changes")
+
+            try:
+                write_if_changed(path, result, current, expected_signature=signature)
+            except FileChangedError:
+                continue
+            return result
+
+
+def merge_notes(base, ours, theirs, today=None):
+    """
+    Three-way merge of a note at the section level. A section changed on one
+    side only takes that side; sections added on either side are kept and
+    sections removed on one side (and untouched on the other) are dropped.
+    Returns the merged text, or None if both sides changed the same section.
+    """
+    base_note, our_note, their_note = (parse_note(text, today) for text in (base, ours, theirs))
+    base_sections = keyed_sections(base_note)
+    our_sections = keyed_sections(our_note)
+    their_sections = keyed_sections(their_note)
+
+    header = merge_part(base_note.header, our_note.header, their_note.header)
+    if header is None:
+        return None
+
+    merged = []
+    for key, theirs_section in their_sections.items():
+        if key in our_sections:
+            section = merge_part(base_sections.get(key), our_sections[key], theirs_section, key)
+        elif key in base_sections:
+            # we removed it: fine unless they changed it
+            if section_text(theirs_section) != section_text(base_sections[key]):
+                return None
+            continue
+        else:
+            section = theirs_section
+        if section is None:
+            return None
+        merged.append((key, section))
+
+    # sections only we have: added by us (kept, after the section they followed) or removed by them
+    keys = list(our_sections)
+    for index, key in enumerate(keys):
+        if key in their_sections:
+            continue
+        if key in base_sections:
+            if section_text(our_sections[key]) != section_text(base_sections[key]):
+                return None
+            continue
+
+        position = 0
+        for previous in reversed(keys[:index]):
+            positions = [i for i, (merged_key, _) in enumerate(merged) if merged_key == previous]
+            if positions:
+                position = positions[0] + 1
+                break
+        merged.insert(position, (key, our_sections[key]))
+
+    return Note(header, [section for _, section in merged]).render()
+
+
+def merge_part(base, ours, theirs, key=None):
+    """Merge one header or section: whichever side changed it wins, both changing it is a conflict."""
+    if key is None:
+        base_text, our_text, their_text = base, ours, theirs
+    else:
+        base_text = section_text(base) if base is not None else None
+        our_text, their_text = section_text(ours), section_text(theirs)
+
+    if our_text == base_text or our_text == their_text:
+        return theirs
+    if their_text == base_text:
+        return ours
+    return None
+
+
+def keyed_sections(note):
+    """Index the sections of a note by title (and occurrence, for repeated titles)."""
+    sections = {}
+    seen = {}
+    for section in note.sections:
+        occurrence = seen.get(section.title, 0)
+        seen[section.title] = occurrence + 1
+        sections[(section.title, occurrence)] = section
+    return sections
+
+
+def section_text(section):
+    return "\n".join(section.lines())
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+import os
+import time
+import ctypes
+import ctypes.util
+import select
+import signal
+import struct
+from pathlib import Path
+from modules import clock
+from modules.calendar_window import DEFAULT_HORIZON_WEEKS
+from modules.manifest import load_manifest, iso_week_key
+from modules.note_cache import read_note
+from modules.storage import flush_writes, file_signature
+from modules.utils import log_action
+
+# minutes between two calendar syncs
+DEFAULT_SYNC_INTERVAL = 15
+
+# inotify flags (linux/inotify.h)
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# inotify_event header: wd, mask, cookie, len (the name follows)
+EVENT_HEADER = struct.Struct("iIII")
+
+# editors save in bursts, wait this long for the burst to end
+DEBOUNCE_SECONDS = 0.5
+
+# how often the polling watcher looks at the inbox
+POLL_SECONDS = 2.0
+
+
+class InotifyWatcher:
+    """Watch a directory with Linux inotify, called through libc (no extra dependency)."""
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {directory}")
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds and return the names of the files that changed."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        names = set()
+        while ready:
+            names |= self.read_names()
+            ready, _, _ = select.select([self.fd], [], [], DEBOUNCE_SECONDS)
+        return names
+
+    def read_names(self):
+        """Read the pending inotify events and return the file names they refer to."""
+        data = os.read(self.fd, 64 * 1024)
+        names = set()
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            names.add(os.fsdecode(data[offset:offset + length].rstrip(b"\0")))
+            offset += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Fallback watcher that compares the mtime and size of the files in a directory."""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        for path in self.directory.iterdir():
+            if path.is_file():
+                stat = path.stat()
+                snapshot[path.name] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds and return the names of the files that changed."""
+        deadline = time.monotonic() + timeout
+        while True:
+            snapshot = self.scan()
+            names = {
+                name for name in snapshot.keys() | self.snapshot.keys()
+                if snapshot.get(name) != self.snapshot.get(name)
+            }
+            self.snapshot = snapshot
+            if names:
+                return names
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return set()
+            time.sleep(min(POLL_SECONDS, remaining))
+
+    def close(self):
+        pass
+
+
+def open_watcher(directory):
+    """Watch a directory with inotify, or by polling where inotify isn't available."""
+    try:
+        return InotifyWatcher(directory)
+    except (OSError, AttributeError) as e:
+        log_action(f"inotify unavailable ({e}), polling {directory} instead")
+        return PollingWatcher(directory)
+
+
+def run_daemon(paths, sync_interval=DEFAULT_SYNC_INTERVAL, calendars=None, horizon_weeks=DEFAULT_HORIZON_WEEKS,
+               local_recurrence=False, snapshot=False, archive_pack=None):
+    """
+    Keep running: watch the inbox and sync the calendar incrementally every
+    sync_interval minutes. The credentials, the calendar client and the parsed
+    note stay in memory between cycles, and only the stage affected by a change
+    runs again:
+    - a new ISO week creates the new weekly note (the --weekly stage)
+    - calendar changes are merged into the current note (the --daily stage)
+    - edits to the notes refresh the parsed note and the task index
+    With snapshot, each sync keeps the week in paths["snapshot_path"] (and logs what changed);
+    archive_pack is passed on to the weekly stage.
+    """
+    from modules.actions import run_weekly_process, refresh_task_index
+
+    # SIGTERM (systemd, docker stop) stops the loop like Ctrl+C does
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    inbox_dir = paths["inbox_dir"]
+    watcher = open_watcher(inbox_dir)
+    state = {"note_path": None, "note": None, "signature": None, "events": None}
+    log_action(f"Daemon watching {inbox_dir}, calendar sync every {sync_interval} min")
+
+    next_sync = time.monotonic()
+    try:
+        while True:
+            changed = watcher.wait(max(0.0, next_sync - time.monotonic()))
+            if changed:
+                on_inbox_change(paths, state, changed, refresh_task_index)
+
+            if time.monotonic() >= next_sync:
+                try:
+                    if week_rolled_over(inbox_dir):
+                        run_weekly_process(paths, archive_pack=archive_pack)
+                        state.update(note_path=None, note=None, signature=None, events=None)
+                    sync_calendar(paths, state, calendars, refresh_task_index, horizon_weeks, local_recurrence, snapshot)
+                except Exception as e:
+                    # a failed cycle (network down, token revoked) waits for the next one
+                    log_action(f"Error: {e}")
+                next_sync = time.monotonic() + sync_interval * 60
+    except KeyboardInterrupt:
+        log_action("Daemon stopped")
+    finally:
+        watcher.close()
+
+
+def week_rolled_over(inbox_dir):
+    """Check if the current note belongs to an earlier ISO week than today."""
+    manifest = load_manifest(inbox_dir)
+    current_week = manifest.get("current") if manifest else None
+    return current_week is not None and current_week < iso_week_key(clock.today())
+
+
+def sync_calendar(paths, state, calendars, refresh_task_index, horizon_weeks=DEFAULT_HORIZON_WEEKS,
+                  local_recurrence=False, snapshot=False):
+    """Sync the calendar and merge it into the current note if anything changed."""
+    from modules.actions import find_current_weekly_note
+    from modules.calendar_sync import sync_google_calendar
+    from modules.task_processor import update_daily_tasks
+
+    calendar_events = sync_google_calendar(
+        paths["token_path"],
+        paths["credentials_path"],
+        store_path=paths["event_store_path"],
+        calendars=calendars,
+        interactive=False,
+        horizon_weeks=horizon_weeks,
+        # a window of one week has nothing for --weekly to seed the next note from
+        window_path=paths["calendar_window_path"] if horizon_weeks > 1 else None,
+        local_recurrence=local_recurrence,
+        snapshot_path=paths["snapshot_path"] if snapshot else None
+    )
+
+    note_path = find_current_weekly_note(paths["inbox_dir"], paths["archive_dir"])
+    fingerprint = repr(calendar_events)
+    if note_path == state["note_path"] and fingerprint == state["events"]:
+        return
+
+    update_daily_tasks(note_path, calendar_events, note=load_note(state, note_path))
+    flush_writes()
+    state["signature"] = file_signature(note_path)
+    state["events"] = fingerprint
+    refresh_task_index(paths)
+
+
+def on_inbox_change(paths, state, names, refresh_task_index):
+    """React to files changed in the inbox by someone else (the editor, a sync tool)."""
+    if not any(name.endswith(".md") for name in names):
+        return
+
+    # our own writes don't count
+    note_path = state["note_path"]
+    if note_path is not None and note_path.name in names and file_signature(note_path) == state["signature"]:
+        names = names - {note_path.name}
+        if not any(name.endswith(".md") for name in names):
+            return
+
+    # the parsed note is stale, parse it again on the next merge
+    state["note"] = None
+    refresh_task_index(paths)
+
+
+def load_note(state, note_path):
+    """Return the parsed note, parsing it again only if the file changed."""
+    signature = file_signature(note_path)
+    if state["note"] is None or state["note_path"] != note_path or state["signature"] != signature:
+        state["note"] = read_note(note_path)
+        state["note_path"] = note_path
+        state["signature"] = signature
+    return state["note"]
+
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+import json
+import sqlite3
+from datetime import datetime
+from modules import clock
+from modules.recurrence import series_end
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sync_state (
+    calendar_id TEXT PRIMARY KEY,
+    sync_token TEXT,
+    synced_at TEXT
+);
+CREATE TABLE IF NOT EXISTS events (
+    calendar_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    start_ts REAL NOT NULL,
+    end_ts REAL NOT NULL,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (calendar_id, event_id)
+);
+CREATE INDEX IF NOT EXISTS events_window ON events (calendar_id, start_ts);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# how events are stored: "instances" (expanded by Google) or "series"
+# (recurring events and their exceptions, expanded locally)
+STORE_MODES = ("instances", "series")
+
+
+def open_event_store(store_path):
+    """Open (and create if needed) the local event store."""
+    conn = sqlite3.connect(str(store_path))
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def get_sync_token(conn, calendar_id):
+    """Return the last sync token stored for a calendar, or None."""
+    row = conn.execute(
+        "SELECT sync_token FROM sync_state WHERE calendar_id = ?", (calendar_id,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def set_store_mode(conn, mode):
+    """
+    Switch the store to a mode (see STORE_MODES). Sync tokens only work with
+    the query they came from, so switching forgets every calendar and the
+    next sync is a full one. Returns True if the mode changed.
+    """
+    row = conn.execute("SELECT value FROM settings WHERE key = 'mode'").fetchone()
+    # stores made before there were modes hold instances
+    current = row[0] if row else "instances"
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO settings VALUES ('mode', ?)", (mode,))
+        if current == mode:
+            return False
+        conn.execute("DELETE FROM events")
+        conn.execute("DELETE FROM sync_state")
+    return True
+
+
+def reset_calendar(conn, calendar_id):
+    """Forget every event and the sync token of a calendar (used before a full resync)."""
+    with conn:
+        conn.execute("DELETE FROM events WHERE calendar_id = ?", (calendar_id,))
+        conn.execute("DELETE FROM sync_state WHERE calendar_id = ?", (calendar_id,))
+
+
+def apply_event_changes(conn, calendar_id, events, sync_token, prune_before=None):
+    """
+    Apply a batch of changed events to the store in a single transaction.
+    Cancelled events are deleted (a cancelled series takes its exceptions
+    with it), everything else is inserted or replaced. Cancelled instances
+    of a series are kept: they hide the instance when it's expanded.
+    """
+    with conn:
+        for event in events:
+            if event.get('status') == 'cancelled' and 'originalStartTime' not in event:
+                conn.execute(
+                    "DELETE FROM events WHERE calendar_id = ? AND (event_id = ? OR event_id LIKE ? ESCAPE '\\')",
+                    (calendar_id, event['id'], escape_like(event['id']) + '\\_%')
+                )
+                continue
+
+            start_ts, end_ts = event_span(event)
+            conn.execute(
+                "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?)",
+                (
+                    calendar_id,
+                    event['id'],
+                    start_ts,
+                    end_ts,
+                    json.dumps(event, separators=(',', ':'))
+                )
+            )
+
+        # drop events that already ended before the window we care about
+        if prune_before is not None:
+            conn.execute(
+                "DELETE FROM events WHERE calendar_id = ? AND end_ts < ?",
+                (calendar_id, prune_before)
+            )
+
+        conn.execute(
+            "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)",
+            (calendar_id, sync_token, clock.now().isoformat())
+        )
+
+
+def load_events(conn, calendar_id, start_time, end_time):
+    """Return stored events overlapping [start_time, end_time), ordered by start time."""
+    rows = conn.execute(
+        "SELECT payload FROM events "
+        "WHERE calendar_id = ? AND start_ts < ? AND end_ts > ? "
+        "ORDER BY start_ts",
+        (calendar_id, to_timestamp(end_time), to_timestamp(start_time))
+    )
+    return [json.loads(payload) for (payload,) in rows]
+
+
+def event_span(event):
+    """
+    Return the start and end timestamps a stored event is found by: a series
+    spans all its instances (forever if it has no end), an exception of one
+    instance also covers the slot it was moved from.
+    """
+    if 'recurrence' in event:
+        end = series_end(event)
+        return event_timestamp(event['start']), end.timestamp() if end else float('inf')
+
+    if 'originalStartTime' in event:
+        original = event_timestamp(event['originalStartTime'])
+        if event.get('status') == 'cancelled':
+            return original, original + 1
+        return (
+            min(original, event_timestamp(event['start'])),
+            max(original + 1, event_timestamp(event['end']))
+        )
+
+    return event_timestamp(event['start']), event_timestamp(event['end'])
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def event_timestamp(event_time):
+    """Convert a Google event start/end object to a POSIX timestamp."""
+    return to_timestamp(event_time.get('dateTime', event_time.get('date')))
+
+
+def to_timestamp(value):
+    """Convert an ISO 8601 string (or datetime) to a POSIX timestamp."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return value.timestamp()
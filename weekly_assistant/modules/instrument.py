@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+import sys
+import json
+import time
+import threading
+from datetime import datetime
+
+# off by default: spans and counts cost one attribute check until enable() is called
+_enabled = False
+# where JSON lines go; None is whatever sys.stdout is when a line is written
+_stream = None
+
+# the open spans, per thread
+_local = threading.local()
+
+
+def open_spans():
+    """Return the stack of spans open in this thread."""
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+
+class Span:
+    """A timed stage of a run; counts added while it's open are logged with its duration."""
+
+    __slots__ = ("name", "fields", "started")
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.started = 0.0
+
+    def __enter__(self):
+        open_spans().append(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ms = (time.perf_counter() - self.started) * 1000
+        stack = open_spans()
+        stack.pop()
+
+        record = {"span": "/".join([span.name for span in stack] + [self.name]), "duration_ms": round(duration_ms, 3)}
+        record.update(self.fields)
+        if exc_type is not None:
+            record["status"] = "error"
+            record["error"] = f"{exc_type.__name__}: {exc}"
+            # the traceback is logged once, by the outermost span
+            if not stack:
+                import traceback
+                record["traceback"] = "".join(traceback.format_exception(exc_type, exc, tb))
+        emit(record)
+        return False
+
+    def count(self, **counts):
+        for key, value in counts.items():
+            self.fields[key] = self.fields.get(key, 0) + value
+
+class NullSpan:
+    """What span() returns while instrumentation is off."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def count(self, **counts):
+        pass
+
+NULL_SPAN = NullSpan()
+
+
+def enable(stream=None):
+    """
+    Turn on spans and switch log_action to JSON lines, written to stream
+    (by default sys.stdout, looked up per line so redirect_stdout applies).
+    """
+    global _enabled, _stream
+    _enabled = True
+    _stream = stream
+
+
+def enabled():
+    return _enabled
+
+
+def span(name, **fields):
+    """Time a stage: `with span("fetch_events") as s: ...; s.count(events=n)`."""
+    if not _enabled:
+        return NULL_SPAN
+    return Span(name, dict(fields))
+
+
+def count(**counts):
+    """Add counts (events fetched, tasks moved, bytes written) to the innermost open span."""
+    if _enabled:
+        stack = open_spans()
+        if stack:
+            stack[-1].count(**counts)
+
+
+def log(message, **fields):
+    """Log a message as a JSON line, tagged with the open span."""
+    record = {"message": message}
+    stack = open_spans()
+    if stack:
+        record["span"] = "/".join(span.name for span in stack)
+    record.update(fields)
+    emit(record)
+
+
+def emit(record):
+    """Write one JSON log line."""
+    line = {"ts": datetime.now().isoformat(timespec="milliseconds")}
+    line.update(record)
+    stream = _stream or sys.stdout
+    stream.write(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+    stream.flush()
+
+
+def carry(function):
+    """
+    Wrap function to run on another thread under the spans open here, so the
+    spans it opens are logged as their children.
+    """
+    parents = list(open_spans())
+
+    def run(*args, **kwargs):
+        _local.stack = list(parents)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            del _local.stack
+
+    return run
+
+
+def run_profiled(function, profile_path, *args, **kwargs):
+    """Run function under cProfile and write the pstats dump to profile_path."""
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        profiler.dump_stats(profile_path)
+        print(f"Profile written to {profile_path} (python -m pstats {profile_path})", file=sys.stderr)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+import os
+import json
+from pathlib import Path
+from modules.concurrency import directory_lock
+from modules.note_cache import parse_cached
+from modules.note_model import note_year
+from modules.storage import atomic_write, read_versioned
+from modules.utils import log_action
+
+# kept in the inbox; Obsidian ignores dotfiles
+MANIFEST_NAME = ".weekly-manifest.json"
+
+WEEKLY_NOTE_GLOB = "*-week-*.md"
+
+
+def manifest_path(inbox_dir):
+    """Return the path of the manifest that belongs to an inbox."""
+    return Path(inbox_dir) / MANIFEST_NAME
+
+
+def load_manifest(inbox_dir):
+    """Load the manifest of an inbox, or None if it doesn't exist (or is unreadable)."""
+    try:
+        with open(manifest_path(inbox_dir), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_manifest(inbox_dir, manifest):
+    """Write the manifest atomically."""
+    atomic_write(manifest_path(inbox_dir), json.dumps(manifest, indent=2, sort_keys=True))
+
+
+def iso_week_key(day):
+    """Return the ISO week of a date as "YYYY-Www"."""
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def record_note(inbox_dir, week_key, note_path, state):
+    """
+    Record a note in the manifest. state is "inbox" or "archived"; the newest
+    week still in the inbox is the current note.
+    """
+    # read-modify-write under the inbox lock, an overlapping run may be recording too
+    with directory_lock(inbox_dir):
+        manifest = load_manifest(inbox_dir) or {"current": None, "notes": {}}
+        manifest["notes"][week_key] = {"path": str(note_path), "state": state}
+
+        if state == "inbox" and (manifest["current"] is None or week_key > manifest["current"]):
+            manifest["current"] = week_key
+        elif state != "inbox" and manifest["current"] == week_key:
+            manifest["current"] = latest_inbox_week(manifest["notes"])
+
+        save_manifest(inbox_dir, manifest)
+
+
+def find_note_week(inbox_dir, note_path):
+    """Return the week key the manifest has for a note path, or None."""
+    manifest = load_manifest(inbox_dir)
+    if manifest is None:
+        return None
+
+    for week_key, entry in manifest["notes"].items():
+        if entry["path"] == str(note_path):
+            return week_key
+    return None
+
+
+def current_note_path(inbox_dir):
+    """Return the path of the current weekly note, or None if the manifest is missing or stale."""
+    manifest = load_manifest(inbox_dir)
+    if not manifest or not manifest.get("current"):
+        return None
+
+    note_path = manifest["notes"][manifest["current"]]["path"]
+    return note_path if os.path.exists(note_path) else None
+
+
+def rebuild_manifest(inbox_dir, archive_dir=None):
+    """Rebuild the manifest by scanning the inbox (and archive) notes."""
+    # under the inbox lock like record_note: a run archiving or creating a note
+    # meanwhile would otherwise be missing from (or overwritten by) the rebuild
+    with directory_lock(inbox_dir):
+        notes = {}
+        for note_dir, state in [(archive_dir, "archived"), (inbox_dir, "inbox")]:
+            if not note_dir or not os.path.isdir(note_dir):
+                continue
+
+            for note_path in Path(note_dir).glob(WEEKLY_NOTE_GLOB):
+                week_key = note_week_key(note_path)
+                if week_key:
+                    notes[week_key] = {"path": str(note_path), "state": state}
+
+            if state == "archived":
+                # notes packed by --archive-pack, read one by one from their packs
+                from modules.archive_pack import scan_packs
+                for note_path, signature, read in scan_packs(note_dir):
+                    week_key = text_week_key(note_path, read(), signature)
+                    if week_key:
+                        notes.setdefault(week_key, {"path": note_path, "state": state})
+
+        manifest = {"current": latest_inbox_week(notes), "notes": notes}
+        save_manifest(inbox_dir, manifest)
+
+    log_action(f"Rebuilt note manifest with {len(notes)} notes")
+    return manifest
+
+
+def note_week_key(note_path):
+    """Work out the ISO week of a note from its first dated day section."""
+    content, signature = read_versioned(note_path)
+    if content is None:
+        return None
+    return text_week_key(note_path, content, signature)
+
+
+def text_week_key(note_path, content, signature):
+    """note_week_key for a note already read (signature as in note_cache.parse_cached)."""
+    note = parse_cached(note_path, content, signature, year=note_year(content))
+    for section in note.sections:
+        if section.day is not None:
+            return iso_week_key(section.day)
+    return None
+
+
+def latest_inbox_week(notes):
+    """Return the newest week that is still in the inbox."""
+    inbox_weeks = [week_key for week_key, entry in notes.items() if entry["state"] == "inbox"]
+    return max(inbox_weeks, default=None)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+import os
+import time
+import marshal
+from pathlib import Path
+from datetime import date
+from modules.instrument import count
+from modules.note_model import Note, DaySection, TaskBlock, parse_note, title_anchor, fallback_anchor, PARSER_VERSION
+from modules.storage import read_versioned, file_signature
+
+# notes kept in the cache; the least recently used ones go first (a few years of weekly notes)
+MAX_ENTRIES = 512
+
+# the coarsest mtime resolution we expect (FAT counts in 2 seconds)
+MTIME_RESOLUTION_NS = 2_000_000_000
+
+# where parsed notes are cached (set by the command line, None disables the cache)
+_cache_dir = None
+
+
+def set_cache_dir(cache_dir):
+    """Cache parsed notes in cache_dir (None turns the cache off) and return the previous dir."""
+    global _cache_dir
+    previous, _cache_dir = _cache_dir, cache_dir
+    return previous
+
+
+def read_note(path, today=None, year=None):
+    """Read and parse a note, through the cache. The note's source is the text read."""
+    text, signature = read_versioned(path)
+    if text is None:
+        raise FileNotFoundError(f"Note not found: {path}")
+    return parse_cached(path, text, signature, today, year)
+
+
+def parse_cached(path, text, signature, today=None, year=None):
+    """
+    Return parse_note(text) for the note at path, from the cache when the
+    entry was stored for the same file size, mtime, parser version and
+    anchor (what the note's days are dated against, see parse_note).
+    signature is the (mtime_ns, size) of the file text was read from.
+    """
+    if _cache_dir is None or signature is None:
+        return parse_note(text, today, year)
+
+    entry_path = cache_entry_path(path)
+    key = entry_key(path, signature, title_anchor(note_header(text)) or fallback_anchor(today, year))
+    try:
+        with open(entry_path, "rb") as f:
+            # loads on the whole buffer, marshal.load on a file reads it in small pieces
+            entry_key_found, digest, payload = marshal.loads(f.read())
+        if entry_key_found == key and (digest is None or digest == content_digest(text)):
+            if digest is not None and not racy(signature):
+                # the mtime has settled, later reads can trust it without hashing
+                write_entry(entry_path, key, None, payload)
+            else:
+                # a hit counts as a use for the LRU
+                os.utime(entry_path)
+            count(note_cache_hits=1)
+            return decode_note(payload, text)
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    count(note_cache_misses=1)
+    note = parse_note(text, today, year)
+    digest = content_digest(text) if racy(signature) else None
+    write_entry(entry_path, key, digest, encode_note(note))
+    return note
+
+
+def remember(path, note, text, today=None, year=None):
+    """
+    Store a note we just wrote (text is what was written), so the next read
+    of it is a hit instead of a parse. The entry always carries the content
+    hash: the file was written a moment ago, and someone else may have
+    written it again by the time its mtime is read.
+    """
+    if _cache_dir is None:
+        return
+
+    signature = file_signature(path)
+    if signature is None:
+        return
+    key = entry_key(path, signature, title_anchor(note.header) or fallback_anchor(today, year))
+    write_entry(cache_entry_path(path), key, content_digest(text), encode_note(note))
+
+
+def write_entry(entry_path, key, digest, payload):
+    """Write a cache entry."""
+    data = marshal.dumps((key, digest, payload))
+    try:
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = entry_path.with_name(f"{entry_path.name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, entry_path)
+        evict(entry_path.parent)
+    except OSError:
+        # the cache is an optimization, a full disk never fails a run
+        pass
+
+
+def evict(cache_dir):
+    """Remove the least recently used entries beyond MAX_ENTRIES."""
+    entries = [entry for entry in os.scandir(cache_dir) if entry.name.endswith(".note")]
+    if len(entries) <= MAX_ENTRIES:
+        return
+
+    entries.sort(key=lambda entry: entry.stat().st_mtime_ns)
+    for entry in entries[:len(entries) - MAX_ENTRIES]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def cache_entry_path(path):
+    """Return the cache file of a note path."""
+    import hashlib
+
+    name = hashlib.blake2b(os.fsencode(os.path.abspath(path)), digest_size=16).hexdigest()
+    return Path(_cache_dir) / f"{name}.note"
+
+
+def entry_key(path, signature, anchor):
+    """What a cache entry must match."""
+    mtime_ns, size = signature
+    return (PARSER_VERSION, os.path.abspath(path), size, mtime_ns, anchor.toordinal())
+
+
+def note_header(text):
+    """The text before a note's first section, where parse_note looks for the title."""
+    if text.startswith("### "):
+        return ""
+    end = text.find("\n### ")
+    return text if end == -1 else text[:end]
+
+
+def racy(signature):
+    """
+    Whether the file's mtime is too recent to tell versions apart: on file
+    systems with coarse mtimes, ticking a checkbox within the same tick keeps
+    both size and mtime. Entries stored then are checked against the content.
+    """
+    mtime_ns, _ = signature
+    return time.time_ns() - mtime_ns < MTIME_RESOLUTION_NS
+
+
+def content_digest(text):
+    import hashlib
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def encode_note(note):
+    """Turn a note into plain tuples marshal can store."""
+    return (
+        note.header,
+        [
+            (
+                section.title,
+                section.weekday,
+                section.date,
+                section.day.toordinal() if section.day else None,
+                [entry if isinstance(entry, str) else tuple(entry.lines) for entry in section.body]
+            )
+            for section in note.sections
+        ]
+    )
+
+
+def decode_note(payload, source):
+    """Rebuild a note from encode_note's tuples."""
+    header, sections = payload
+    return Note(
+        header,
+        [
+            DaySection(
+                title,
+                weekday,
+                day_date,
+                date.fromordinal(day) if day is not None else None,
+                [entry if isinstance(entry, str) else TaskBlock(list(entry)) for entry in body]
+            )
+            for title, weekday, day_date, day, body in sections
+        ],
+        source
+    )
@@ -4,17 +4,56 @@ import os
 import shutil
 import calendar
 from pathlib import Path
-from datetime import datetime, timedelta
+from dataclasses import dataclass
+from datetime import date, timedelta
+from modules import clock
+from modules.concurrency import directory_lock
+from modules.manifest import record_note, find_note_week, note_week_key, iso_week_key
+from modules.note_model import parse_note
+from modules.storage import write_if_changed, schedule_fsync
 from modules.utils import log_action
 
-def create_weekly_note(weekly_notes_dir):
-    """Create a new weekly note with the correct template and return its path."""
-    today = datetime.today()
+@dataclass(frozen=True)
+class WeekContext:
+    """Everything a run needs to know about the current week, computed once."""
+    today: date
+    week_dates: dict
+    week_number: int
+    month_name: str
+    ordinal_week: str
+    week_key: str
+
+
+def week_context(today=None):
+    """Build the WeekContext for a date (defaults to today on the active clock)."""
+    if today is None:
+        today = clock.today()
     
-    # get the week dates and metadata
-    week_dates = get_week_dates(today)
     week_number = get_week_number(today)
-    month_name = get_month_name(today)
+    return WeekContext(
+        today=today,
+        week_dates=get_week_dates(today),
+        week_number=week_number,
+        month_name=get_month_name(today),
+        ordinal_week=get_ordinal_week(week_number, today),
+        week_key=iso_week_key(today)
+    )
+
+
+def create_weekly_note(weekly_notes_dir, context=None, calendar_events=None):
+    """
+    Create a new weekly note with the correct template and return its path.
+    calendar_events (organized by day) are added to the note before it's
+    written, so it starts out with the week's events.
+    """
+    if context is None:
+        context = week_context()
+    
+    # get the week dates and metadata
+    today = context.today
+    week_dates = context.week_dates
+    week_number = context.week_number
+    month_name = context.month_name
     
     # generate content
     content = f"""# This Week in {month_name} (Week {week_number}, {today.year})
@@ -39,9 +78,11 @@ def create_weekly_note(weekly_notes_dir):
 
 """
     
+    if calendar_events:
+        content = seed_calendar_events(content, context, calendar_events)
+    
     # generate filename
-    ordinal_week = get_ordinal_week(week_number)
-    filename = f"{ordinal_week}-week-{month_name.lower()}-{today.year}.md"
+    filename = f"{context.ordinal_week}-week-{month_name.lower()}-{today.year}.md"
     
     # ensure directory exists
     weekly_notes_dir = Path(weekly_notes_dir)
@@ -49,14 +90,32 @@ def create_weekly_note(weekly_notes_dir):
     
     # write file
     note_path = weekly_notes_dir / filename
-    note_path.write_text(content, encoding="utf-8")
+    write_if_changed(note_path, content)
+    
+    # this is now the current note
+    record_note(weekly_notes_dir, context.week_key, note_path, "inbox")
     
     log_action(f"Created new weekly note: {note_path}")
     return str(note_path)
 
 
-def archive_weekly_note(note_path, archive_dir):
-    """Move a note from inbox to archive."""
+def seed_calendar_events(content, context, calendar_events):
+    """Add calendar events to the content of a new note."""
+    from modules.task_processor import add_calendar_events_to_day
+
+    note = parse_note(content, context.today)
+    for section in note.sections:
+        if section.weekday in calendar_events:
+            add_calendar_events_to_day(section, calendar_events[section.weekday])
+    return note.render()
+
+
+def archive_weekly_note(note_path, archive_dir, pack=None):
+    """
+    Move a note from inbox to archive. With pack ("month" or "year", see
+    archive_pack.PACK_MODES) it goes into that month's or year's zip pack
+    instead of staying a file of its own.
+    """
     try:
         # ensure archive directory exists
         Path(archive_dir).mkdir(parents=True, exist_ok=True)
@@ -64,9 +123,18 @@ def archive_weekly_note(note_path, archive_dir):
         # determine destination path
         source_path = Path(note_path)
         dest_path = Path(archive_dir) / source_path.name
+        week_key = find_note_week(source_path.parent, source_path) or note_week_key(source_path)
         
-        # move the file
-        shutil.move(str(source_path), str(dest_path))
+        if pack and week_key:
+            from modules.archive_pack import pack_note, pack_path
+            dest_path = pack_note(source_path, pack_path(archive_dir, week_key, pack))
+        else:
+            # move the file (under the inbox lock, so it never happens in the middle of a commit)
+            with directory_lock(source_path.parent):
+                shutil.move(str(source_path), str(dest_path))
+            schedule_fsync(dest_path)
+        if week_key:
+            record_note(source_path.parent, week_key, dest_path, "archived")
         
         log_action(f"Archived note from {source_path} to {dest_path}")
         return str(dest_path)
@@ -78,7 +146,7 @@ def archive_weekly_note(note_path, archive_dir):
 def get_week_dates(today=None):
     """Get dates for each day of the current week."""
     if today is None:
-        today = datetime.today()
+        today = clock.today()
         
     # find start of week (Monday)
     start_of_week = today - timedelta(days=today.weekday())
@@ -106,7 +174,7 @@ def get_week_number(today=None):
     Returns maximum of 5 weeks, with week 5 only for months that have 29+ days.
     """
     if today is None:
-        today = datetime.today()
+        today = clock.today()
         
     day = today.day
 
@@ -119,7 +187,7 @@ def get_week_number(today=None):
 def get_month_name(today=None):
     """Get the current month name."""
     if today is None:
-        today = datetime.today()
+        today = clock.today()
         
     return today.strftime("%B")
 
@@ -131,7 +199,7 @@ def is_last_week_of_month(today=None):
     constitute a new week after the current week ends.
     """
     if today is None:
-        today = datetime.today()
+        today = clock.today()
     
     # get the last day of the month
     last_day = calendar.monthrange(today.year, today.month)[1]
@@ -148,7 +216,7 @@ def get_ordinal_week(week_number, today=None):
     Uses 'last' for the final week of the month regardless of number.
     """
     if today is None:
-        today = datetime.today()
+        today = clock.today()
     
     # check if this is the last week of the month
     if is_last_week_of_month(today):
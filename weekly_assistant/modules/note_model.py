@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+import re
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Optional, Union
+from modules import clock
+
+# "### Monday (13/10)" -> weekday, day, month
+DAY_HEADER_PATTERN = re.compile(r"### (\w+) \((\d{2})/(\d{2})\)")
+
+# "# This Week in October (Week 3, 2026)" -> year
+TITLE_YEAR_PATTERN = re.compile(r"\(Week \d+, (\d{4})\)")
+
+# the same title -> month name, year (the month and year the note was created in)
+TITLE_PATTERN = re.compile(r"This Week in (\w+) \(Week \d+, (\d{4})\)")
+
+MONTH_NAMES = ("January", "February", "March", "April", "May", "June", "July",
+               "August", "September", "October", "November", "December")
+
+# indentation that makes a line part of the task above it
+SUBTASK_INDENT = ("    ", "\t")
+
+# bump whenever parse_note changes what it returns, it invalidates the note cache
+PARSER_VERSION = 2
+
+
+@dataclass(eq=False)
+class TaskBlock:
+    """A task line followed by its indented subtask lines."""
+    lines: list[str]
+
+    @property
+    def task(self) -> str:
+        return self.lines[0]
+
+    @property
+    def completed(self) -> bool:
+        return "- [x]" in self.lines[0]
+
+    def copy(self) -> "TaskBlock":
+        return TaskBlock(list(self.lines))
+
+
+@dataclass(eq=False)
+class DaySection:
+    """A "### Weekday (DD/MM)" section; body holds plain lines and task blocks in order."""
+    title: str
+    weekday: Optional[str] = None
+    date: Optional[str] = None
+    day: Optional[date] = None
+    body: list[Union[str, TaskBlock]] = field(default_factory=list)
+
+    @property
+    def tasks(self) -> list[TaskBlock]:
+        return [entry for entry in self.body if isinstance(entry, TaskBlock)]
+
+    def is_future(self, today: date) -> bool:
+        return self.day is not None and self.day > today
+
+    def lines(self) -> list[str]:
+        """Return the body as plain text lines."""
+        lines = []
+        for entry in self.body:
+            if isinstance(entry, TaskBlock):
+                lines.extend(entry.lines)
+            else:
+                lines.append(entry)
+        return lines
+
+
+@dataclass(eq=False)
+class Note:
+    """
+    A weekly note: the text before the first section plus its day sections.
+    source is the text it was parsed from (the version changes are based on).
+    """
+    header: str
+    sections: list[DaySection] = field(default_factory=list)
+    source: Optional[str] = field(default=None, repr=False)
+
+    def sections_by_date(self) -> dict[str, DaySection]:
+        """Index the day sections by their "DD/MM" date (first section wins)."""
+        index = {}
+        for section in self.sections:
+            if section.date is not None:
+                index.setdefault(section.date, section)
+        return index
+
+    def render(self) -> str:
+        """Serialize the note back to markdown in a single buffer."""
+        parts = [self.header, "\n\n"]
+        for section in self.sections:
+            parts.append(section.title)
+            parts.append("\n")
+            parts.append("\n".join(section.lines()))
+            parts.append("\n\n")
+        return "".join(parts)
+
+
+def parse_note(content, today=None, year=None):
+    """
+    Parse a weekly note in a single pass over its lines.
+    Day dates ("DD/MM") get their year from the note's own week: the first one
+    takes the year that puts it closest to the month in the note's title (for
+    a note without one, see fallback_anchor), each next one the year closest to
+    the day before it. So 29/12, 30/12, 31/12 and 01/01 read as one week
+    whenever the note is parsed.
+    """
+    anchor = None
+    header_lines = []
+    sections = []
+    section = None
+    block = None
+
+    for line in content.splitlines():
+        if line.startswith("### "):
+            if anchor is None:
+                anchor = title_anchor("\n".join(header_lines)) or fallback_anchor(today, year)
+            section = new_section(line.rstrip(), anchor)
+            if section.day is not None:
+                anchor = section.day
+            sections.append(section)
+            block = None
+        elif section is None:
+            header_lines.append(line)
+        elif block is not None and line.startswith(SUBTASK_INDENT):
+            block.lines.append(line)
+        elif line.lstrip().startswith("- ["):
+            block = TaskBlock([line])
+            section.body.append(block)
+        else:
+            block = None
+            section.body.append(line)
+
+    # sections don't keep blank lines around their content
+    for section in sections:
+        trim_blank_lines(section.body)
+
+    return Note("\n".join(header_lines).strip(), sections, content)
+
+
+def note_year(content):
+    """Return the year written in a note's title, or None."""
+    match = TITLE_YEAR_PATTERN.search(content, 0, 500)
+    return int(match.group(1)) if match else None
+
+
+def title_anchor(header):
+    """Return the middle of the month a note's title names, or None without a title."""
+    match = TITLE_PATTERN.search(header)
+    if not match or match.group(1) not in MONTH_NAMES:
+        return None
+    return date(int(match.group(2)), MONTH_NAMES.index(match.group(1)) + 1, 15)
+
+
+def fallback_anchor(today=None, year=None):
+    """
+    What the days of a note without a title are resolved against: the middle
+    of today's month (defaults to now), or of year when it's given.
+    """
+    if year is not None:
+        return date(year, 7, 1)
+    today = today or clock.today()
+    return date(today.year, today.month, 15)
+
+
+def new_section(title, anchor):
+    """Create a section from its header line, resolving its date (the one closest to anchor) if it has one."""
+    match = DAY_HEADER_PATTERN.match(title)
+    if not match:
+        return DaySection(title)
+
+    weekday, day, month = match.groups()
+    return DaySection(title, weekday, f"{day}/{month}", nearest_date(int(day), int(month), anchor))
+
+
+def nearest_date(day, month, anchor):
+    """Return the date with that day and month closest to anchor, or None if there is none."""
+    candidates = []
+    for year in (anchor.year - 1, anchor.year, anchor.year + 1):
+        try:
+            candidates.append(date(year, month, day))
+        except ValueError:
+            # invalid date (or 29/02 outside a leap year)
+            pass
+    return min(candidates, key=lambda candidate: abs(candidate - anchor), default=None)
+
+
+def trim_blank_lines(body):
+    """Drop blank plain lines from both ends of a section body, in place."""
+    while body and isinstance(body[-1], str) and not body[-1].strip():
+        body.pop()
+
+    start = 0
+    while start < len(body) and isinstance(body[start], str) and not body[start].strip():
+        start += 1
+    del body[:start]
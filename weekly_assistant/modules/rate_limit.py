@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+import json
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from modules import clock
+from modules.instrument import count
+from modules.utils import log_action
+
+# Calendar API calls per second (Google's default per-user quota is 600 a
+# minute) and how many can go out at once after a quiet spell
+DEFAULT_RATE = 10.0
+DEFAULT_BURST = 10
+
+# after a quota error the rate is halved (never below MIN_RATE) and each
+# successful call gives back RECOVERY of the configured rate
+MIN_RATE = 0.5
+RECOVERY = 0.05
+
+# retries of a call: full-jitter exponential backoff from BASE_DELAY up to MAX_DELAY seconds
+MAX_ATTEMPTS = 6
+BASE_DELAY = 0.5
+MAX_DELAY = 32.0
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+QUOTA_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "quotaExceeded"}
+
+# state slots of a limiter
+TOKENS, UPDATED, RATE, PAUSED_UNTIL = range(4)
+
+# tokens a refill may fall short by (float rounding) and still count as whole
+EPSILON = 1e-6
+
+
+class RateLimiter:
+    """
+    A token bucket for API calls that adapts to quota errors: each one halves
+    the rate (and pauses everyone for Retry-After), successful calls bring it
+    back up to the configured rate. Built with a multiprocessing context its
+    state lives in shared memory, so forked batch workers share one budget.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, context=None, timer=time.monotonic, sleep=time.sleep):
+        self.max_rate = rate
+        self.burst = burst
+        self.timer = timer
+        self.sleep = sleep
+        state = [float(burst), timer(), float(rate), 0.0]
+        if context is None:
+            self.state, self.lock = state, threading.Lock()
+        else:
+            self.state, self.lock = context.Array("d", state, lock=False), context.Lock()
+
+    def acquire(self, calls=1):
+        """Wait until calls may go out and return the seconds waited."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = self.refill()
+                if now < self.state[PAUSED_UNTIL]:
+                    wait = self.state[PAUSED_UNTIL] - now
+                elif self.state[TOKENS] + EPSILON >= min(calls, self.burst):
+                    # a batch bigger than the bucket goes out and leaves it in debt
+                    self.state[TOKENS] -= calls
+                    return waited
+                else:
+                    wait = (min(calls, self.burst) - self.state[TOKENS]) / self.state[RATE]
+            self.sleep(wait)
+            waited += wait
+
+    def refill(self):
+        """Add the tokens earned since the last update (call with the lock held); returns now."""
+        now = self.timer()
+        earned = (now - self.state[UPDATED]) * self.state[RATE]
+        self.state[TOKENS] = min(float(self.burst), self.state[TOKENS] + earned)
+        self.state[UPDATED] = now
+        return now
+
+    def slow_down(self, retry_after=None):
+        """React to a quota error: halve the rate and, with retry_after, stop all calls for that long."""
+        with self.lock:
+            now = self.refill()
+            self.state[RATE] = max(MIN_RATE, self.state[RATE] / 2)
+            if retry_after:
+                self.state[PAUSED_UNTIL] = max(self.state[PAUSED_UNTIL], now + retry_after)
+
+    def speed_up(self):
+        """Give back part of the rate after a successful call."""
+        with self.lock:
+            if self.state[RATE] < self.max_rate:
+                self.refill()
+                self.state[RATE] = min(self.max_rate, self.state[RATE] + self.max_rate * RECOVERY)
+
+    def rate(self):
+        return self.state[RATE]
+
+
+_limiter = RateLimiter()
+
+_metrics = {"api_calls": 0, "api_retries": 0, "quota_errors": 0, "throttled_seconds": 0.0}
+
+
+def set_limiter(limiter):
+    """Replace the limiter every API call goes through and return the previous one."""
+    global _limiter
+    previous, _limiter = _limiter, limiter
+    return previous
+
+
+def metrics():
+    """Return the API metrics of this process: calls, retries, quota errors and seconds spent throttled."""
+    return dict(_metrics)
+
+
+def call_api(request, calls=1):
+    """
+    Execute a Google API request (or a batch of calls requests) through the
+    rate limiter. Transient errors (quota, 5xx, dropped connections) are
+    retried with backoff; the last error is raised once MAX_ATTEMPTS are spent.
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        throttle(_limiter.acquire(calls))
+        _metrics["api_calls"] += calls
+        count(api_calls=calls)
+        try:
+            result = request.execute()
+        except Exception as error:
+            if not is_retryable(error) or attempt + 1 == MAX_ATTEMPTS:
+                raise
+            delay = retry_delay(error, attempt)
+            log_action(f"Calendar API call failed ({describe(error)}), retrying in {delay:.1f}s")
+            throttle(pause(delay))
+            continue
+        _limiter.speed_up()
+        return result
+
+
+def retry_delay(error, attempt):
+    """
+    Record a retryable error and return how long to wait before attempt + 1:
+    full jitter, but never less than the Retry-After the server asked for.
+    """
+    _metrics["api_retries"] += 1
+    count(api_retries=1)
+
+    retry_after = get_retry_after(error)
+    if is_quota_error(error):
+        _metrics["quota_errors"] += 1
+        _limiter.slow_down(retry_after)
+
+    delay = random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+    return max(delay, retry_after or 0.0)
+
+
+def pause(seconds):
+    """Sleep for a backoff (on the limiter's clock) and return the seconds slept."""
+    _limiter.sleep(seconds)
+    return seconds
+
+
+def throttle(seconds):
+    if seconds:
+        _metrics["throttled_seconds"] += seconds
+        count(throttled_ms=round(seconds * 1000, 3))
+
+
+def is_retryable(error):
+    """Check if an API error is worth retrying: quota errors, server errors and network failures."""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    status = error_status(error)
+    return status in RETRY_STATUSES or is_quota_error(error)
+
+
+def is_quota_error(error):
+    """Check if an error means we're calling too fast (429, or a 403 with a rate limit reason)."""
+    status = error_status(error)
+    return status == 429 or (status == 403 and bool(error_reasons(error) & QUOTA_REASONS))
+
+
+def error_status(error):
+    resp = getattr(error, "resp", None)
+    return getattr(resp, "status", None)
+
+
+def error_reasons(error):
+    """Return the reasons listed in the JSON body of an API error."""
+    try:
+        content = error.content.decode("utf-8") if isinstance(error.content, bytes) else error.content
+        details = json.loads(content)["error"]
+    except (AttributeError, ValueError, KeyError, TypeError):
+        return set()
+    return {item.get("reason") for item in details.get("errors", []) + details.get("details", []) if isinstance(item, dict)}
+
+
+def get_retry_after(error):
+    """Return the Retry-After of an error response in seconds, or None."""
+    resp = getattr(error, "resp", None)
+    value = resp.get("retry-after") if hasattr(resp, "get") else None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (moment - clock.now(moment.tzinfo)).total_seconds())
+
+
+def describe(error):
+    status = error_status(error)
+    return f"HTTP {status}" if status else type(error).__name__
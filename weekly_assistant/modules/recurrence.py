@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+
+import calendar
+import datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+from modules.instrument import count
+from modules.utils import log_action
+
+WEEKDAYS = {"MO": 0, "TU": 1, "WE": 2, "TH": 3, "FR": 4, "SA": 5, "SU": 6}
+
+# the RRULE parts expanded here: everything Google Calendar's recurrence editor
+# produces; series using anything else are expanded by the server instead
+SUPPORTED_PARTS = {"FREQ", "INTERVAL", "COUNT", "UNTIL", "BYDAY", "BYMONTHDAY", "BYMONTH", "WKST"}
+FREQUENCIES = ("DAILY", "WEEKLY", "MONTHLY", "YEARLY")
+
+# instance fields copied from the recurring event (the master)
+INSTANCE_FIELDS = ("etag", "status", "summary", "attendees")
+
+# expansions kept in memory, one per (series, window): the daemon syncs the same window all day
+EXPANSION_CACHE_SIZE = 1024
+
+# how far a COUNT-limited series is followed to find its last instance
+MAX_SERIES_YEARS = 100
+
+UTC = datetime.timezone.utc
+
+
+class UnsupportedRecurrence(ValueError):
+    """A recurrence rule this module doesn't expand."""
+
+
+def expand_events(events, start_time, end_time, fetch_instances=None):
+    """
+    Turn events listed with singleEvents=False (single events, recurring
+    masters and the exceptions of their instances) into what singleEvents=True
+    returns for [start_time, end_time): every master is replaced by its
+    instances in the window, exceptions (moved, renamed, declined or
+    cancelled instances) replace the instance they stand for. A master whose
+    rule can't be expanded here is passed to fetch_instances(master), which
+    returns the server-expanded instances, if given.
+    """
+    window_start, window_end = parse_bound(start_time), parse_bound(end_time)
+
+    masters, exceptions, single_events, expanded = [], {}, [], []
+    for event in events:
+        if "recurrence" in event:
+            masters.append(event)
+        elif "recurringEventId" in event and "originalStartTime" in event:
+            exceptions[(event["recurringEventId"], time_key(event["originalStartTime"]))] = event
+        elif event.get("status") != "cancelled":
+            single_events.append(event)
+
+    server_expanded = set()
+    for master in masters:
+        if master.get("status") == "cancelled":
+            continue
+        try:
+            instances = expand_master(master, window_start, window_end)
+        except UnsupportedRecurrence as error:
+            if fetch_instances is None:
+                log_action(f"Skipping recurring event {master.get('summary', master['id'])}: {error}")
+                continue
+            log_action(f"Fetching the instances of {master.get('summary', master['id'])} from Google: {error}")
+            server_expanded.add(master["id"])
+            expanded.extend(event for event in fetch_instances(master) if event.get("status") != "cancelled")
+            continue
+
+        count(instances_expanded=len(instances))
+        expanded.extend(
+            instance for instance in instances
+            if (master["id"], time_key(instance["originalStartTime"])) not in exceptions
+        )
+
+    # exceptions show up where they are now, which may be outside the window
+    for (master_id, _), event in exceptions.items():
+        if master_id in server_expanded or event.get("status") == "cancelled":
+            continue
+        start, end = event_bounds(event, window_start.tzinfo)
+        if start < window_end and end > window_start:
+            expanded.append(event)
+
+    # in start order; instances go before single events starting at the same time
+    expanded.extend(single_events)
+    expanded.sort(key=lambda event: event_bounds(event, window_start.tzinfo)[0])
+    return expanded
+
+
+def expand_master(master, window_start, window_end):
+    """Return the instances of a recurring event overlapping [window_start, window_end)."""
+    dtstart, tz, duration = series_start(master)
+    starts = expand_rule(tuple(master["recurrence"]), dtstart, tz, duration, window_start, window_end)
+    return [make_instance(master, start, tz, duration) for start in starts]
+
+
+@lru_cache(maxsize=EXPANSION_CACHE_SIZE)
+def expand_rule(recurrence, dtstart, tz, duration, window_start, window_end):
+    """
+    Return the starts (local wall times, or dates for all-day events) of the
+    instances of a recurrence overlapping [window_start, window_end).
+    Memoized: a series is expanded once per window, until it changes.
+    """
+    all_day = not isinstance(dtstart, datetime.datetime)
+    rules, rdates, exdates = parse_recurrence(recurrence, tz, all_day)
+
+    # a day of slack on both ends: the window and the event may be in different time zones
+    first_day = window_start.date() - as_days(duration) - datetime.timedelta(days=1)
+    last_day = window_end.date() + datetime.timedelta(days=1)
+
+    starts = {start for start in rdates if first_day <= day_of(start) <= last_day}
+    for rule in rules:
+        for start in occurrences(rule, dtstart, first_day, last_day):
+            if day_of(start) >= first_day:
+                starts.add(start)
+    starts -= exdates
+
+    selected = []
+    for start in sorted(starts):
+        instance_start = localize(start, tz, window_start.tzinfo)
+        instance_end = localize(start + duration, tz, window_start.tzinfo)
+        if instance_start < window_end and instance_end > window_start:
+            selected.append(start)
+    return tuple(selected)
+
+
+def occurrences(rule, dtstart, first_day, last_day):
+    """
+    Yield the starts of a rule in order, from dtstart (always the first
+    instance) until COUNT, UNTIL or last_day. Without COUNT, periods ending
+    before first_day are skipped instead of walked through.
+    """
+    all_day = not isinstance(dtstart, datetime.datetime)
+    start_day = day_of(dtstart)
+    until, remaining = rule["until"], rule["count"]
+
+    yield dtstart
+    if remaining is not None:
+        remaining -= 1
+
+    period = 0 if remaining is not None else first_period(rule, start_day, first_day)
+    while remaining is None or remaining > 0:
+        # checked per period too: some rules have periods without any day (BYMONTHDAY=30;BYMONTH=2)
+        if period_start(rule, start_day, period) > last_day:
+            return
+        for day in candidate_days(rule, start_day, period):
+            if day > last_day:
+                return
+            start = day if all_day else datetime.datetime.combine(day, dtstart.time())
+            if start <= dtstart:
+                continue
+            if until is not None and start > until:
+                return
+            yield start
+            if remaining is not None:
+                remaining -= 1
+                if remaining == 0:
+                    return
+        period += 1
+
+
+def period_start(rule, start_day, period):
+    """Return the first day of the period-th period of a rule."""
+    interval, freq = rule["interval"], rule["freq"]
+    if freq == "DAILY":
+        return start_day + datetime.timedelta(days=period * interval)
+    if freq == "WEEKLY":
+        week_start = start_day - datetime.timedelta(days=(start_day.weekday() - rule["wkst"]) % 7)
+        return week_start + datetime.timedelta(weeks=period * interval)
+    if freq == "MONTHLY":
+        year, month = divmod(start_day.year * 12 + start_day.month - 1 + period * interval, 12)
+        return datetime.date(year, month + 1, 1)
+    return datetime.date(start_day.year + period * interval, 1, 1)
+
+
+def candidate_days(rule, start_day, period):
+    """Return the days of the period-th period of a rule, sorted."""
+    freq = rule["freq"]
+    first = period_start(rule, start_day, period)
+
+    if freq == "DAILY":
+        return [first] if matches_limits(rule, first, by_day=True, by_month_day=True) else []
+
+    if freq == "WEEKLY":
+        weekdays = {weekday for _, weekday in rule["byday"]} or {start_day.weekday()}
+        days = [first + datetime.timedelta(days=offset) for offset in range(7)]
+        return [day for day in days if day.weekday() in weekdays and matches_limits(rule, day)]
+
+    if freq == "MONTHLY":
+        if not matches_limits(rule, first):
+            return []
+        return month_days(rule, first.year, first.month, start_day)
+
+    year = first.year
+    if rule["byday"] and not rule["bymonth"]:
+        # weekdays counted over the whole year (FREQ=YEARLY;BYDAY=20MO)
+        raise UnsupportedRecurrence("yearly BYDAY without BYMONTH")
+    days = []
+    # without BYMONTH, BYMONTHDAY picks its days in every month (FREQ=YEARLY;BYMONTHDAY=1)
+    months = rule["bymonth"] or (range(1, 13) if rule["bymonthday"] else [start_day.month])
+    for month in months:
+        if rule["byday"] or rule["bymonthday"]:
+            days.extend(month_days(rule, year, month, start_day))
+        elif start_day.day <= calendar.monthrange(year, month)[1]:
+            days.append(datetime.date(year, month, start_day.day))
+    return sorted(days)
+
+
+def month_days(rule, year, month, start_day):
+    """Return the days of a month selected by BYMONTHDAY and BYDAY (or the start day's number)."""
+    last = calendar.monthrange(year, month)[1]
+
+    by_month_day = None
+    if rule["bymonthday"]:
+        by_month_day = {number if number > 0 else last + 1 + number for number in rule["bymonthday"]}
+
+    by_day = None
+    if rule["byday"]:
+        by_day = set()
+        for ordinal, weekday in rule["byday"]:
+            days = [day for day in range(1, last + 1) if calendar.weekday(year, month, day) == weekday]
+            if ordinal is None:
+                by_day.update(days)
+            elif -len(days) <= ordinal <= len(days) and ordinal != 0:
+                by_day.add(days[ordinal - 1] if ordinal > 0 else days[ordinal])
+
+    if by_month_day is None and by_day is None:
+        selected = {start_day.day}
+    elif by_month_day is None:
+        selected = by_day
+    elif by_day is None:
+        selected = by_month_day
+    else:
+        selected = by_month_day & by_day
+    return [datetime.date(year, month, day) for day in sorted(selected) if 1 <= day <= last]
+
+
+def first_period(rule, start_day, first_day):
+    """Return the first period that can reach first_day (periods before it are skipped)."""
+    if first_day <= start_day:
+        return 0
+
+    interval, freq = rule["interval"], rule["freq"]
+    if freq == "DAILY":
+        return (first_day - start_day).days // interval
+    if freq == "WEEKLY":
+        return (first_day - start_day).days // 7 // interval
+    if freq == "MONTHLY":
+        months = (first_day.year - start_day.year) * 12 + first_day.month - start_day.month
+        return max(0, months) // interval
+    return max(0, first_day.year - start_day.year) // interval
+
+
+def matches_limits(rule, day, by_day=False, by_month_day=False):
+    """Check BYMONTH (and for daily rules BYDAY and BYMONTHDAY, which only limit)."""
+    if rule["bymonth"] and day.month not in rule["bymonth"]:
+        return False
+    if by_day and rule["byday"] and day.weekday() not in {weekday for _, weekday in rule["byday"]}:
+        return False
+    if by_month_day and rule["bymonthday"]:
+        last = calendar.monthrange(day.year, day.month)[1]
+        numbers = {number if number > 0 else last + 1 + number for number in rule["bymonthday"]}
+        if day.day not in numbers:
+            return False
+    return True
+
+
+def parse_recurrence(recurrence, tz, all_day):
+    """Split the recurrence lines of an event into its rules, extra dates and excluded dates."""
+    rules, rdates, exdates = [], set(), set()
+    for line in recurrence:
+        name, _, value = line.partition(":")
+        name, *params = name.split(";")
+        name = name.upper()
+        if name == "RRULE":
+            rules.append(parse_rule(value, tz, all_day))
+        elif name in ("RDATE", "EXDATE"):
+            params = dict(param.split("=", 1) for param in params)
+            if params.get("VALUE") == "PERIOD":
+                raise UnsupportedRecurrence("RDATE periods")
+            dates = {parse_date_value(item, params.get("TZID"), tz, all_day) for item in value.split(",")}
+            (rdates if name == "RDATE" else exdates).update(dates)
+        else:
+            raise UnsupportedRecurrence(f"{name} lines")
+    return rules, rdates, exdates
+
+
+@lru_cache(maxsize=256)
+def parse_rule(value, tz, all_day):
+    """Parse the value of an RRULE line."""
+    parts = dict(part.split("=", 1) for part in value.split(";") if part)
+    unsupported = set(parts) - SUPPORTED_PARTS
+    if unsupported:
+        raise UnsupportedRecurrence(f"RRULE {', '.join(sorted(unsupported))}")
+    if parts.get("FREQ") not in FREQUENCIES:
+        raise UnsupportedRecurrence(f"FREQ={parts.get('FREQ')}")
+
+    byday = []
+    for item in parts["BYDAY"].split(",") if "BYDAY" in parts else []:
+        ordinal, weekday = item[:-2], item[-2:]
+        byday.append((int(ordinal) if ordinal else None, WEEKDAYS[weekday]))
+    if any(ordinal is not None for ordinal, _ in byday) and parts["FREQ"] in ("DAILY", "WEEKLY"):
+        raise UnsupportedRecurrence(f"numbered BYDAY in a {parts['FREQ']} rule")
+
+    return {
+        "freq": parts["FREQ"],
+        "interval": max(1, int(parts.get("INTERVAL", 1))),
+        "count": int(parts["COUNT"]) if "COUNT" in parts else None,
+        "until": parse_date_value(parts["UNTIL"], None, tz, all_day) if "UNTIL" in parts else None,
+        "byday": byday,
+        "bymonthday": [int(number) for number in parts["BYMONTHDAY"].split(",")] if "BYMONTHDAY" in parts else [],
+        "bymonth": [int(number) for number in parts["BYMONTH"].split(",")] if "BYMONTH" in parts else [],
+        "wkst": WEEKDAYS[parts.get("WKST", "MO")]
+    }
+
+
+def parse_date_value(value, tzid, tz, all_day):
+    """
+    Parse an iCalendar DATE or DATE-TIME (UTC, with a TZID or floating) into
+    the event's local wall time, the way instance starts are compared.
+    """
+    if "T" not in value:
+        day = datetime.datetime.strptime(value, "%Y%m%d").date()
+        return day if all_day else datetime.datetime.combine(day, datetime.time.max)
+
+    moment = datetime.datetime.strptime(value.rstrip("Z"), "%Y%m%dT%H%M%S")
+    if value.endswith("Z"):
+        moment = moment.replace(tzinfo=UTC).astimezone(tz).replace(tzinfo=None)
+    elif tzid:
+        moment = moment.replace(tzinfo=ZoneInfo(tzid)).astimezone(tz).replace(tzinfo=None)
+    return moment.date() if all_day else moment
+
+
+def series_start(master):
+    """Return the first start of a series (local wall time, or a date), its time zone and duration."""
+    start, end = master["start"], master["end"]
+    if "date" in start:
+        dtstart = datetime.date.fromisoformat(start["date"])
+        return dtstart, None, datetime.date.fromisoformat(end["date"]) - dtstart
+
+    first = parse_bound(start["dateTime"])
+    # without a time zone the offset of the first instance is used for all of them
+    tz = ZoneInfo(start["timeZone"]) if start.get("timeZone") else first.tzinfo
+    dtstart = first.astimezone(tz).replace(tzinfo=None)
+    last = parse_bound(end["dateTime"]).astimezone(tz).replace(tzinfo=None)
+    return dtstart, tz, last - dtstart
+
+
+def series_end(master):
+    """Return when the last instance of a series ends (an aware datetime), or None if it never does."""
+    try:
+        dtstart, tz, duration = series_start(master)
+        rules, rdates, _ = parse_recurrence(tuple(master["recurrence"]), tz, tz is None)
+        last_day = day_of(dtstart) + datetime.timedelta(days=365 * MAX_SERIES_YEARS)
+        ends = list(rdates) + [dtstart]
+        for rule in rules:
+            if rule["until"] is not None:
+                ends.append(rule["until"])
+            elif rule["count"] is not None:
+                ends.extend(occurrences(rule, dtstart, day_of(dtstart), last_day))
+            else:
+                return None
+    except (UnsupportedRecurrence, KeyError, ValueError, TypeError):
+        return None
+    return localize(max(ends) + duration, tz, UTC)
+
+
+def make_instance(master, start, tz, duration):
+    """Build the instance of a series starting at start, like events.list with singleEvents returns it."""
+    instance = {key: master[key] for key in INSTANCE_FIELDS if key in master}
+    if tz is None:
+        instance_start = {"date": start.isoformat()}
+        instance_end = {"date": (start + duration).isoformat()}
+        suffix = f"{start:%Y%m%d}"
+    else:
+        time_zone = {"timeZone": master["start"]["timeZone"]} if master["start"].get("timeZone") else {}
+        aware_start = start.replace(tzinfo=tz)
+        instance_start = {"dateTime": aware_start.isoformat(), **time_zone}
+        instance_end = {"dateTime": (start + duration).replace(tzinfo=tz).isoformat(), **time_zone}
+        suffix = f"{aware_start.astimezone(UTC):%Y%m%dT%H%M%SZ}"
+
+    instance.update({
+        "id": f"{master['id']}_{suffix}",
+        "start": instance_start,
+        "end": instance_end,
+        "recurringEventId": master["id"],
+        "originalStartTime": dict(instance_start)
+    })
+    return instance
+
+
+def time_key(event_time):
+    """What identifies an instance within its series: its original start (a date or a UTC moment)."""
+    if "date" in event_time:
+        return event_time["date"]
+    return parse_bound(event_time["dateTime"]).astimezone(UTC)
+
+
+def event_bounds(event, tz):
+    """Return the start and end of an event as aware datetimes (all-day events start at midnight in tz)."""
+    return tuple(
+        datetime.datetime.combine(datetime.date.fromisoformat(value["date"]), datetime.time(), tz)
+        if "date" in value else parse_bound(value["dateTime"])
+        for value in (event["start"], event["end"])
+    )
+
+
+def localize(start, tz, window_tz):
+    """Turn an instance start (local wall time in tz, or a date) into an aware datetime."""
+    if tz is None:
+        return datetime.datetime.combine(start, datetime.time(), window_tz)
+    return start.replace(tzinfo=tz)
+
+
+def parse_bound(value):
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def day_of(start):
+    return start.date() if isinstance(start, datetime.datetime) else start
+
+
+def as_days(duration):
+    return datetime.timedelta(days=duration.days + 1)
@@ -0,0 +1,517 @@
+#!/usr/bin/env python
+
+import io
+import re
+import json
+import random
+import shutil
+import tempfile
+import contextlib
+from pathlib import Path
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+from modules import clock, note_cache, rate_limit
+from modules.clock import FixedClock
+from modules.archive_pack import split_packed_path, read_packed_note
+from modules.calendar_window import local_zone
+from modules.manifest import load_manifest, iso_week_key
+from modules.note_manager import week_context
+from modules.note_model import parse_note
+from modules.storage import set_fsync_mode
+
+# the cron schedule from the README: --weekly on Monday 04:00, --daily every day at 05:00
+WEEKLY_AT = time(4, 0)
+DAILY_AT = time(5, 0)
+
+EVENT_MARKER = re.compile(r"<!-- gcal:(\S+) ")
+
+# the standup is a recurring event that started long before any simulation
+STANDUP_SINCE = date(2020, 1, 6)
+STANDUP_RULE = "RRULE:FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR"
+
+
+class SyntheticCalendar:
+    """
+    A deterministic stand-in for the Google Calendar service. It answers
+    events().list (paging, time windows, sync tokens and singleEvents),
+    calendarList().list and batch requests with generated weeks of events: a
+    recurring daily standup, weekly meetings and random one-offs, some of
+    which get rescheduled, renamed, declined or cancelled as the (simulated)
+    clock moves on. Changed standups are exceptions of the standup series.
+    With error_rate, that share of the calls fails like an overloaded API
+    does (429 with Retry-After, or 503).
+    """
+
+    def __init__(self, seed=0, meetings_per_week=15, calendar_ids=("primary",), timezone="America/Sao_Paulo",
+                 error_rate=0.0):
+        self.seed = seed
+        self.error_rate = error_rate
+        self.errors = random.Random(f"{seed}:errors")
+        self.meetings_per_week = meetings_per_week
+        self.calendar_ids = list(calendar_ids)
+        self.tz = ZoneInfo(timezone)
+        self.weeks = {}
+        self.requests = 0
+        self.failed_requests = 0
+        self.bytes = 0
+
+    # --- Google API surface -------------------------------------------------
+
+    def events(self):
+        return self
+
+    def calendarList(self):
+        return CalendarListResource(self)
+
+    def new_batch_http_request(self, callback=None):
+        return SyntheticBatch(callback)
+
+    def list(self, calendarId="primary", timeMin=None, timeMax=None, syncToken=None,
+             pageToken=None, maxResults=250, singleEvents=False, **params):
+        return SyntheticRequest(self.list_page, calendarId, timeMin, timeMax, syncToken, pageToken, maxResults,
+                                singleEvents)
+
+    # --- generation ---------------------------------------------------------
+
+    def list_page(self, calendar_id, time_min, time_max, sync_token, page_token, max_results, single_events):
+        """Build one page of an events.list response."""
+        self.requests += 1
+        if self.errors.random() < self.error_rate:
+            self.failed_requests += 1
+            raise synthetic_error(self.errors)
+        now = clock.now(self.tz)
+
+        if sync_token:
+            # deltas: resend the recent window, cancellations included
+            start, end = now - timedelta(days=7), now + timedelta(weeks=4)
+            show_cancelled = True
+        else:
+            start = datetime.fromisoformat(time_min) if time_min else now
+            end = datetime.fromisoformat(time_max) if time_max else start + timedelta(weeks=4)
+            show_cancelled = False
+
+        if single_events:
+            items = [
+                event for event in self.events_between(calendar_id, start, end, now)
+                if show_cancelled or event["status"] != "cancelled"
+            ]
+        else:
+            # the series, single events and the instances that were changed
+            # (cancelled instances are listed anyway, like Google does)
+            series = self.standup_series(calendar_id)
+            items = [series]
+            for event in self.events_between(calendar_id, start, end, now, original=True):
+                if "recurringEventId" in event:
+                    if event["etag"] != series["etag"]:
+                        items.append(event)
+                elif show_cancelled or event["status"] != "cancelled":
+                    items.append(event)
+
+        offset = int(page_token or 0)
+        page = {"items": items[offset:offset + max_results]}
+        if offset + max_results < len(items):
+            page["nextPageToken"] = str(offset + max_results)
+        else:
+            page["nextSyncToken"] = f"sync-{now.isoformat()}"
+        self.bytes += len(json.dumps(page))
+        return page
+
+    def events_between(self, calendar_id, start, end, now, original=False):
+        """
+        Return the events of a calendar overlapping [start, end) as seen at now
+        (with original, also the instances that were moved away from it).
+        """
+        monday = start.date() - timedelta(days=start.weekday()) - timedelta(weeks=1 if original else 0)
+        events = []
+        while monday < end.date():
+            for event in self.week_events(calendar_id, monday, now):
+                if parse_time(event["start"]) < end and parse_time(event["end"]) > start:
+                    events.append(event)
+                elif original and "originalStartTime" in event and start <= parse_time(event["originalStartTime"]) < end:
+                    events.append(event)
+            monday += timedelta(days=7)
+
+        events.sort(key=lambda event: parse_time(event["start"]))
+        return events
+
+    def week_events(self, calendar_id, monday, now):
+        """Return the events of one week, with the changes that already happened at now applied."""
+        key = (calendar_id, monday)
+        if key not in self.weeks:
+            self.weeks[key] = self.generate_week(calendar_id, monday)
+
+        events = []
+        for plan in self.weeks[key]:
+            version = sum(1 for change_at in plan["changes"] if change_at <= now)
+            events.append(self.render_event(plan, version))
+        return events
+
+    def generate_week(self, calendar_id, monday):
+        """Plan the events of a week; each plan lists the moments it changes at."""
+        rng = random.Random(f"{self.seed}:{calendar_id}:{monday.isoformat()}")
+        week_start = datetime.combine(monday, time(0, 0), self.tz)
+        plans = []
+
+        # the instances of the standup series, a few of them changed
+        for day in range(5):
+            start = week_start + timedelta(days=day, hours=9)
+            plan = self.plan(rng, calendar_id, "standup", "Daily standup", start, 15, changes=rng.random() < 0.1)
+            plan["series"] = plan["id"]
+            plan["id"] = f"{plan['id']}_{start.astimezone(ZoneInfo('UTC')):%Y%m%dT%H%M%SZ}"
+            plans.append(plan)
+
+        # meetings and one-offs
+        for number in range(self.meetings_per_week):
+            start = week_start + timedelta(days=rng.randrange(7), hours=rng.randrange(8, 19), minutes=rng.choice([0, 30]))
+            plans.append(self.plan(rng, calendar_id, f"meet{monday:%Y%m%d}{number}",
+                                   f"Meeting {rng.randrange(1000)}", start, rng.choice([30, 60, 90])))
+        return plans
+
+    def plan(self, rng, calendar_id, event_id, summary, start, minutes, changes=True):
+        """Plan one event and the moments (during the week before it) it changes at."""
+        change_count = rng.choice([0, 0, 0, 1, 2]) if changes else 0
+        return {
+            "id": f"{calendar_id[:4]}{event_id}",
+            "summary": summary,
+            "start": start,
+            "minutes": minutes,
+            "kinds": [rng.choice(["move", "rename", "cancel", "decline"]) for _ in range(change_count)],
+            "changes": sorted(start - timedelta(hours=rng.randrange(1, 24 * 7)) for _ in range(change_count))
+        }
+
+    def render_event(self, plan, version):
+        """Build the API resource of a planned event after its first version changes."""
+        start, summary, status, response = plan["start"], plan["summary"], "confirmed", "accepted"
+        for kind in plan["kinds"][:version]:
+            if kind == "move":
+                start += timedelta(hours=1)
+            elif kind == "rename":
+                summary += " (updated)"
+            elif kind == "cancel":
+                status = "cancelled"
+            else:
+                response = "declined"
+
+        end = start + timedelta(minutes=plan["minutes"])
+        event = {
+            "id": plan["id"],
+            "etag": f'"{version}"',
+            "status": status,
+            "summary": summary,
+            "start": {"dateTime": start.isoformat()},
+            "end": {"dateTime": end.isoformat()},
+            "attendees": [{"self": True, "responseStatus": response}]
+        }
+        if "series" in plan:
+            # unchanged instances look like the series they come from
+            time_zone = {"timeZone": self.tz.key}
+            event["etag"] = f'"{version}"' if version else '"series"'
+            event["start"].update(time_zone)
+            event["end"].update(time_zone)
+            event["recurringEventId"] = plan["series"]
+            event["originalStartTime"] = {"dateTime": plan["start"].isoformat(), **time_zone}
+        return event
+
+    def standup_series(self, calendar_id):
+        """Build the API resource of the standup series itself (singleEvents=False)."""
+        start = datetime.combine(STANDUP_SINCE, time(9, 0), self.tz)
+        time_zone = {"timeZone": self.tz.key}
+        return {
+            "id": f"{calendar_id[:4]}standup",
+            "etag": '"series"',
+            "status": "confirmed",
+            "summary": "Daily standup",
+            "start": {"dateTime": start.isoformat(), **time_zone},
+            "end": {"dateTime": (start + timedelta(minutes=15)).isoformat(), **time_zone},
+            "recurrence": [STANDUP_RULE],
+            "attendees": [{"self": True, "responseStatus": "accepted"}]
+        }
+
+
+class SyntheticRequest:
+    """A lazy request, like the ones the Google client returns."""
+
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+
+    def execute(self):
+        return self.function(*self.args)
+
+
+class SyntheticBatch:
+    """Runs the added requests one by one and reports each to the callback."""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None, callback=None):
+        self.requests.append((request_id, request, callback or self.callback))
+
+    def execute(self):
+        for request_id, request, callback in self.requests:
+            try:
+                page = request.execute()
+            except Exception as error:
+                callback(request_id, None, error)
+                continue
+            callback(request_id, page, None)
+
+
+class CalendarListResource:
+    def __init__(self, calendar):
+        self.calendar = calendar
+
+    def list(self, pageToken=None, **params):
+        items = [{"id": calendar_id, "selected": True} for calendar_id in self.calendar.calendar_ids]
+        return SyntheticRequest(lambda: {"items": items})
+
+
+class SyntheticResponse(dict):
+    """The response headers and status of a failed call."""
+
+    def __init__(self, status, reason, headers):
+        super().__init__(headers)
+        self.status = status
+        self.reason = reason
+
+
+class SimulatedTimer:
+    """
+    Monotonic time for the rate limiter: the simulated clock plus the time
+    slept so far, so backoffs take no real time.
+    """
+
+    def __init__(self, sim_clock):
+        self.sim_clock = sim_clock
+        self.slept = 0.0
+
+    def monotonic(self):
+        return self.sim_clock.now().timestamp() + self.slept
+
+    def sleep(self, seconds):
+        self.slept += seconds
+
+
+def synthetic_error(rng):
+    """Build the error of a throttled (429) or overloaded (503) call."""
+    from googleapiclient.errors import HttpError
+
+    if rng.random() < 0.5:
+        response = SyntheticResponse(429, "Too Many Requests", {"retry-after": str(rng.randrange(1, 5))})
+        content = {"error": {"code": 429, "message": "Rate Limit Exceeded", "errors": [{"reason": "rateLimitExceeded"}]}}
+    else:
+        response = SyntheticResponse(503, "Service Unavailable", {})
+        content = {"error": {"code": 503, "message": "The service is currently unavailable."}}
+    return HttpError(response, json.dumps(content).encode("utf-8"))
+
+
+def parse_time(event_time):
+    return datetime.fromisoformat(event_time["dateTime"])
+
+
+def run_simulation(start, end, seed=0, daily=True, incremental=False, calendar_ids=("primary",),
+                   completion_ratio=0.9, vault_dir=None, local_recurrence=False, error_rate=0.0, archive_pack=None):
+    """
+    Replay the cron schedule from start to end (dates, inclusive) against a
+    synthetic calendar and a temporary vault, checking invariants after each
+    run. Every evening a simulated user checks off completion_ratio of the
+    day's open tasks; error_rate of the API calls fail (and are retried, on
+    simulated time); archive_pack is passed on to --weekly. Returns a report
+    dict; report["violations"] lists what went wrong.
+    """
+    from modules.actions import run_weekly_process, run_daily_process
+    from modules.calendar_sync import CalendarFetchError
+    from modules.note_manager import create_weekly_note
+    from modules.utils import setup_paths
+
+    own_vault = vault_dir is None
+    vault_dir = Path(vault_dir or tempfile.mkdtemp(prefix="weekly-sim-"))
+    vault = {
+        "name": "simulation",
+        "inbox_dir": str(vault_dir / "inbox"),
+        "archive_dir": str(vault_dir / "archive"),
+        "state_dir": str(vault_dir / "state")
+    }
+    calendar = SyntheticCalendar(seed=seed, calendar_ids=calendar_ids, error_rate=error_rate)
+    user = random.Random(seed)
+    sim_clock = FixedClock(datetime.combine(start, WEEKLY_AT))
+    previous_clock = clock.set_clock(sim_clock)
+    timer = SimulatedTimer(sim_clock)
+    previous_limiter = rate_limit.set_limiter(rate_limit.RateLimiter(timer=timer.monotonic, sleep=timer.sleep))
+    api_before = rate_limit.metrics()
+    # a throwaway vault doesn't need to survive a power loss
+    previous_fsync = set_fsync_mode("off")
+    previous_cache_dir = note_cache.set_cache_dir(str(vault_dir / "state" / "cache" / "notes"))
+
+    report = {"days": 0, "weekly_runs": 0, "daily_runs": 0, "failed_daily_runs": 0, "violations": []}
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log):
+            paths = setup_paths(vault)
+
+            # the vault starts with the note of the first week, made on its Monday like cron would
+            create_weekly_note(paths["inbox_dir"], week_context(start - timedelta(days=start.weekday())))
+
+            day = start
+            while day <= end:
+                report["days"] += 1
+
+                if day.weekday() == 0 and day != start:
+                    sim_clock.set(datetime.combine(day, WEEKLY_AT))
+                    context = week_context(day)
+                    run_weekly_process(paths, context, archive_pack)
+                    report["weekly_runs"] += 1
+                    check_weekly(paths, context, report)
+
+                if daily:
+                    sim_clock.set(datetime.combine(day, DAILY_AT))
+                    context = week_context(day)
+                    note_before = current_note_text(paths)
+                    try:
+                        run_daily_process(
+                            paths,
+                            incremental=incremental,
+                            calendars=list(calendar_ids),
+                            context=context,
+                            service=calendar,
+                            local_recurrence=local_recurrence
+                        )
+                    except CalendarFetchError:
+                        # out of retries: the run fails and must leave the note alone
+                        report["failed_daily_runs"] += 1
+                        if current_note_text(paths) != note_before:
+                            report["violations"].append(f"{context.today}: a failed sync changed the note")
+                    report["daily_runs"] += 1
+                    check_daily(paths, context, report, calendar, calendar_ids)
+
+                complete_tasks(paths, day, completion_ratio, user)
+
+                day += timedelta(days=1)
+    finally:
+        clock.set_clock(previous_clock)
+        rate_limit.set_limiter(previous_limiter)
+        set_fsync_mode(previous_fsync)
+        note_cache.set_cache_dir(previous_cache_dir)
+        if own_vault:
+            shutil.rmtree(vault_dir, ignore_errors=True)
+
+    report["api_requests"] = calendar.requests
+    report["api_bytes"] = calendar.bytes
+    report["api_failures"] = calendar.failed_requests
+    api_after = rate_limit.metrics()
+    report["api_retries"] = api_after["api_retries"] - api_before["api_retries"]
+    report["throttled_seconds"] = api_after["throttled_seconds"] - api_before["throttled_seconds"]
+    return report
+
+
+def check_weekly(paths, context, report):
+    """After --weekly: the manifest points to a note of this week and nothing is left behind."""
+    manifest = load_manifest(paths["inbox_dir"])
+    if not manifest or manifest["current"] != context.week_key:
+        report["violations"].append(f"{context.today}: manifest current is not {context.week_key}")
+
+    inbox_notes = list(Path(paths["inbox_dir"]).glob("*-week-*.md"))
+    if len(inbox_notes) != 1:
+        report["violations"].append(f"{context.today}: {len(inbox_notes)} notes in the inbox")
+
+    # the new note only holds this week's days, and nothing already done was carried over
+    monday = context.today - timedelta(days=context.today.weekday())
+    this_week = {monday + timedelta(days=offset) for offset in range(7)}
+    if manifest and manifest["current"]:
+        note = parse_note(current_note_text(paths), context.today)
+        stray = sorted(str(section.day) for section in note.sections if section.day and section.day not in this_week)
+        if stray:
+            report["violations"].append(f"{context.today}: the new note has days of other weeks {stray}")
+        carried_done = [task.task for section in note.sections for task in section.tasks if task.completed]
+        if carried_done:
+            report["violations"].append(f"{context.today}: completed tasks carried over {carried_done[:3]}")
+
+    # last week's note can be read where the manifest says it was archived (a file or a pack), with all its days
+    last_week = manifest["notes"].get(iso_week_key(monday - timedelta(days=7))) if manifest else None
+    if last_week is not None:
+        text = read_archived(last_week["path"])
+        if text is None:
+            report["violations"].append(f"{context.today}: archived note {last_week['path']} can't be read")
+        else:
+            days = {section.day for section in parse_note(text, context.today).sections if section.day}
+            missing = sorted(str(day - timedelta(days=7)) for day in this_week if day - timedelta(days=7) not in days)
+            if missing:
+                report["violations"].append(f"{context.today}: archived note lost its days {missing}")
+
+
+def read_archived(path):
+    """Return the text of an archived note (plain or packed), or None if it's not there."""
+    try:
+        if split_packed_path(path):
+            return read_packed_note(path)
+        return Path(path).read_text(encoding="utf-8")
+    except (OSError, KeyError):
+        return None
+
+
+def check_daily(paths, context, report, calendar, calendar_ids):
+    """
+    After --daily: the note round-trips through the parser, has no duplicated
+    events and every event task sits in the section of the day its event is on.
+    """
+    manifest = load_manifest(paths["inbox_dir"])
+    note_path = Path(manifest["notes"][manifest["current"]]["path"])
+    content = note_path.read_text(encoding="utf-8")
+
+    note = parse_note(content, context.today)
+    if note.render() != content:
+        report["violations"].append(f"{context.today}: {note_path.name} does not round-trip")
+
+    # markers are stripped when tasks are carried over, so every marked task is an event of this note's week
+    event_days = synthetic_event_days(calendar, calendar_ids, context.today)
+    for section in note.sections:
+        for task_block in section.tasks:
+            match = EVENT_MARKER.search(task_block.task)
+            if match and event_days.get(match.group(1)) != section.day:
+                report["violations"].append(
+                    f"{context.today}: event {match.group(1)} of {event_days.get(match.group(1))} is under {section.title}"
+                )
+
+    duplicates = [event_id for event_id, count in Counter(EVENT_MARKER.findall(content)).items() if count > 1]
+    if duplicates:
+        report["violations"].append(f"{context.today}: duplicated events {duplicates[:3]}")
+
+
+def synthetic_event_days(calendar, calendar_ids, today):
+    """Map the id of every event around today's week to its day in the configured timezone."""
+    tz = local_zone()
+    monday = datetime.combine(today - timedelta(days=today.weekday()), time(0, 0), tz)
+    now = clock.now(calendar.tz)
+    return {
+        event["id"]: parse_time(event["start"]).astimezone(tz).date()
+        for calendar_id in calendar_ids
+        for event in calendar.events_between(calendar_id, monday - timedelta(weeks=1), monday + timedelta(weeks=2), now)
+    }
+
+
+def current_note_text(paths):
+    manifest = load_manifest(paths["inbox_dir"])
+    return Path(manifest["notes"][manifest["current"]]["path"]).read_text(encoding="utf-8")
+
+
+def complete_tasks(paths, day, ratio, rng):
+    """Check off part of the open tasks of a day, like the user would during the day."""
+    manifest = load_manifest(paths["inbox_dir"])
+    note_path = Path(manifest["notes"][manifest["current"]]["path"])
+    note = parse_note(note_path.read_text(encoding="utf-8"), day)
+
+    for section in note.sections:
+        if section.day != day:
+            continue
+        for task_block in section.tasks:
+            if not task_block.completed and rng.random() < ratio:
+                task_block.lines[0] = task_block.task.replace("- [ ]", "- [x]", 1)
+
+    note_path.write_text(note.render(), encoding="utf-8")
+
+
+def parse_date(value):
+    return date.fromisoformat(value)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+import os
+import stat
+import itertools
+from pathlib import Path
+from modules.instrument import count
+from modules.utils import log_action
+
+# when to fsync what was written:
+# - "off": never (the OS flushes on its own, a power loss may lose the last run)
+# - "each": every file and its directory right after the write
+# - "batch": once per run, when flush_writes() is called
+FSYNC_MODES = ("off", "each", "batch")
+
+_fsync_mode = "batch"
+_pending_fsync = []
+
+# makes temp file names unique within the process
+_tmp_counter = itertools.count()
+
+SECTION_PREFIX = "### "
+
+
+def set_fsync_mode(mode):
+    """Choose when writes are fsynced (see FSYNC_MODES) and return the previous mode."""
+    global _fsync_mode
+    if mode not in FSYNC_MODES:
+        raise ValueError(f"Unknown fsync mode: {mode}")
+    previous, _fsync_mode = _fsync_mode, mode
+    return previous
+
+
+class FileChangedError(OSError):
+    """The file changed on disk between reading it and replacing it."""
+
+
+def content_hash(text):
+    """Return the hash notes are compared by."""
+    # imported here: loading OpenSSL would cost --weekly a few ms of startup
+    import hashlib
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def read_text(path):
+    """Return the text of a file, or None if it doesn't exist."""
+    try:
+        return Path(path).read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return None
+
+
+def read_versioned(path):
+    """Return the text of a file and its (mtime_ns, size) signature, or (None, None) if it doesn't exist."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+            stat_result = os.fstat(f.fileno())
+    except FileNotFoundError:
+        return None, None
+    return data.decode("utf-8"), (stat_result.st_mtime_ns, stat_result.st_size)
+
+
+def file_signature(path):
+    """Return the (mtime_ns, size) signature of a file, or None if it doesn't exist."""
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat_result.st_mtime_ns, stat_result.st_size
+
+
+def write_if_changed(path, content, original=None, expected_signature=None):
+    """
+    Write content to path unless the file already holds it; returns "created",
+    "updated" or "unchanged". original is the text the caller read the file as
+    (it saves reading it again). The file is replaced atomically, so a crash
+    leaves either the old or the new note, never half of one. With
+    expected_signature, FileChangedError is raised instead of replacing a
+    file that changed since it was read.
+    """
+    path = Path(path)
+    if original is None:
+        original = read_text(path)
+
+    if original is not None and content_hash(original) == content_hash(content):
+        count(files_unchanged=1)
+        log_action(f"No changes in {path}, not written")
+        return "unchanged"
+
+    atomic_write(path, content, expected_signature)
+    count(files_written=1)
+
+    if original is None:
+        log_action(f"Created {path}")
+        return "created"
+
+    sections = changed_sections(original, content)
+    log_action(f"Updated {path} ({', '.join(sections) if sections else 'header'} changed)")
+    return "updated"
+
+
+def atomic_write(path, content, expected_signature=None):
+    """
+    Write content (text, or bytes) to a temp file next to path, then move it
+    over path. With expected_signature, the move only happens if path still has it.
+    """
+    path = Path(path)
+    data = content if isinstance(content, bytes) else content.encode("utf-8")
+
+    # the temp file is a dotfile in the same directory: same filesystem for
+    # os.replace, and hidden from Obsidian while it exists
+    tmp_path = path.parent / f".{path.name}.{os.getpid()}.{next(_tmp_counter)}.tmp"
+    # created like any new file (0o666 minus the umask); the umask can only be
+    # read by changing it, and that would race with the other threads
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            if _fsync_mode == "each":
+                f.flush()
+                os.fsync(f.fileno())
+
+        # keep the permissions of the note being replaced
+        try:
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode))
+        except FileNotFoundError:
+            pass
+
+        if expected_signature is not None and file_signature(path) != expected_signature:
+            raise FileChangedError(f"{path} changed while it was being written")
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    count(bytes_written=len(data))
+    schedule_fsync(path)
+
+
+def schedule_fsync(path):
+    """Make a file written (or moved) outside atomic_write durable, as the fsync mode says."""
+    path = Path(path)
+    if _fsync_mode == "each":
+        fsync_directory(path.parent)
+    elif _fsync_mode == "batch":
+        _pending_fsync.append(path)
+
+
+def flush_writes():
+    """fsync the files written since the last flush, and their directories (once each)."""
+    paths = list(dict.fromkeys(_pending_fsync))
+    _pending_fsync.clear()
+
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            # moved on since (archived notes are scheduled again at their new path)
+            continue
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    for directory in dict.fromkeys(path.parent for path in paths):
+        fsync_directory(directory)
+
+
+def fsync_directory(directory):
+    """fsync a directory so the renames inside it are durable."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def changed_sections(old_text, new_text):
+    """Return the titles of the "### " sections that differ between two versions of a note."""
+    old_sections = split_sections(old_text)
+    new_sections = split_sections(new_text)
+
+    changed = [title for title, text in new_sections.items() if old_sections.get(title) != text]
+    changed.extend(title for title in old_sections if title not in new_sections)
+    return [title[len(SECTION_PREFIX):] for title in changed if title]
+
+
+def split_sections(text):
+    """Split a note into {section title: section text}; the header is under ""."""
+    sections = {}
+    title, lines = "", []
+    for line in text.split("\n"):
+        if line.startswith(SECTION_PREFIX):
+            sections[title] = "\n".join(lines)
+            title, lines = line, []
+        lines.append(line)
+    sections[title] = "\n".join(lines)
+    return sections
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+import re
+import sqlite3
+from pathlib import Path
+from modules.archive_pack import scan_packs
+from modules.note_cache import parse_cached
+from modules.note_model import note_year
+from modules.utils import log_action
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    day TEXT,
+    completed INTEGER NOT NULL,
+    task TEXT NOT NULL,
+    block TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_path ON tasks (path);
+CREATE INDEX IF NOT EXISTS tasks_task ON tasks (task);
+CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+    task, block, content='tasks', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS tasks_insert AFTER INSERT ON tasks BEGIN
+    INSERT INTO tasks_fts (rowid, task, block) VALUES (new.id, new.task, new.block);
+END;
+CREATE TRIGGER IF NOT EXISTS tasks_delete AFTER DELETE ON tasks BEGIN
+    INSERT INTO tasks_fts (tasks_fts, rowid, task, block) VALUES ('delete', old.id, old.task, old.block);
+END;
+"""
+
+# "- [ ] ~~text~~ <!-- gcal:id etag -->" -> "text"
+CHECKBOX_PATTERN = re.compile(r"^\s*- \[.\]\s*")
+MARKER_PATTERN = re.compile(r"\s*<!--.*?-->\s*$")
+
+WEEKLY_NOTE_GLOB = "*-week-*.md"
+
+STATUS_FILTERS = {
+    "open": "latest.completed = 0",
+    "done": "latest.completed = 1"
+}
+
+
+def open_task_index(index_path):
+    """Open (and create if needed) the task index."""
+    conn = sqlite3.connect(str(index_path))
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def update_task_index(index_path, note_dirs):
+    """
+    Bring the index up to date with the weekly notes in note_dirs, plain files
+    and archive packs. Only notes whose mtime (CRC, when packed) or size
+    changed are parsed again.
+    """
+    conn = open_task_index(index_path)
+    try:
+        indexed = {
+            path: (mtime_ns, size)
+            for path, mtime_ns, size in conn.execute("SELECT path, mtime_ns, size FROM notes")
+        }
+
+        updated = 0
+        with conn:
+            for note_dir in note_dirs:
+                for note_path in Path(note_dir).glob(WEEKLY_NOTE_GLOB):
+                    stat = note_path.stat()
+                    path = str(note_path)
+                    if indexed.pop(path, None) == (stat.st_mtime_ns, stat.st_size):
+                        continue
+
+                    index_note(conn, path, note_path.read_text(encoding="utf-8"), (stat.st_mtime_ns, stat.st_size))
+                    updated += 1
+
+                # packed notes are versioned by (CRC, size): adding a note to a pack leaves the others alone
+                for path, signature, read in scan_packs(note_dir):
+                    if indexed.pop(path, None) == signature:
+                        continue
+
+                    index_note(conn, path, read(), signature)
+                    updated += 1
+
+            # whatever is left was deleted or moved away
+            for path in indexed:
+                forget_note(conn, path)
+    finally:
+        conn.close()
+
+    if updated or indexed:
+        log_action(f"Task index updated: {updated} notes indexed, {len(indexed)} removed")
+
+
+def index_note(conn, path, content, signature):
+    """Replace the indexed tasks of one note; signature is its (mtime_ns, size), (CRC, size) if packed."""
+    forget_note(conn, path)
+
+    note = parse_cached(path, content, signature, year=note_year(content))
+    rows = []
+    for section in note.sections:
+        day = section.day.isoformat() if section.day else None
+        for task_block in section.tasks:
+            rows.append((
+                path,
+                day,
+                int(task_block.completed),
+                task_text(task_block.task),
+                "\n".join(task_block.lines)
+            ))
+
+    conn.executemany(
+        "INSERT INTO tasks (path, day, completed, task, block) VALUES (?, ?, ?, ?, ?)", rows
+    )
+    conn.execute(
+        "INSERT INTO notes VALUES (?, ?, ?)", (path, *signature)
+    )
+
+
+def forget_note(conn, path):
+    """Remove a note and its tasks from the index."""
+    conn.execute("DELETE FROM tasks WHERE path = ?", (path,))
+    conn.execute("DELETE FROM notes WHERE path = ?", (path,))
+
+
+def task_text(task_line):
+    """Normalize a task line to its text: no checkbox, strike-through or event marker."""
+    text = MARKER_PATTERN.sub("", CHECKBOX_PATTERN.sub("", task_line))
+    if text.startswith("~~") and text.endswith("~~"):
+        text = text[2:-2]
+    return text.strip()
+
+
+def query_tasks(index_path, text, status="all", limit=50):
+    """
+    Search indexed tasks (and their subtasks) mentioning text. Identical tasks are grouped: each
+    result says in how many weekly notes the task shows up (how often it was
+    carried over) and whether its latest occurrence is still open.
+    """
+    status_filter = STATUS_FILTERS.get(status, "1")
+
+    # quote the search text as a phrase so FTS syntax characters are taken literally
+    phrase = '"' + text.replace('"', '""') + '"'
+
+    conn = open_task_index(index_path)
+    try:
+        rows = conn.execute(
+            f"""
+            WITH matches AS (
+                SELECT DISTINCT tasks.task FROM tasks_fts
+                JOIN tasks ON tasks.id = tasks_fts.rowid
+                WHERE tasks_fts MATCH ?
+            ),
+            occurrences AS (
+                SELECT tasks.task, COUNT(DISTINCT tasks.path) AS weeks,
+                       MIN(tasks.day) AS first_day, MAX(tasks.day) AS last_day
+                FROM tasks JOIN matches ON matches.task = tasks.task
+                GROUP BY tasks.task
+            ),
+            latest AS (
+                SELECT tasks.task, tasks.completed, tasks.path,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY tasks.task ORDER BY tasks.day DESC, tasks.id DESC
+                       ) AS position
+                FROM tasks JOIN matches ON matches.task = tasks.task
+            )
+            SELECT occurrences.task, latest.completed, occurrences.weeks,
+                   occurrences.first_day, occurrences.last_day, latest.path
+            FROM occurrences
+            JOIN latest ON latest.task = occurrences.task AND latest.position = 1
+            WHERE {status_filter}
+            ORDER BY occurrences.last_day DESC
+            LIMIT ?
+            """,
+            (phrase, limit)
+        ).fetchall()
+    finally:
+        conn.close()
+
+    return [
+        {
+            "task": task,
+            "completed": bool(completed),
+            "weeks": weeks,
+            "first_day": first_day,
+            "last_day": last_day,
+            "path": path
+        }
+        for task, completed, weeks, first_day, last_day, path in rows
+    ]
@@ -2,322 +2,326 @@
 
 import re
 from pathlib import Path
-from datetime import datetime
-from modules.utils import parse_day_sections, extract_day_date, is_future_date, log_action
+from collections import Counter
+from modules import clock
+from modules.instrument import span, count
+from modules.note_model import DaySection, TaskBlock
+from modules.concurrency import update_note, load_note
+from modules.utils import log_action
 
-def process_weekly_tasks(current_note_path, new_note_path):
+# hidden marker tying a generated task to its Google Calendar event: <!-- gcal:id etag -->
+EVENT_MARKER_PATTERN = re.compile(r" ?<!-- gcal:(\S+) (\S*) -->$")
+
+def process_weekly_tasks(current_note_path, new_note_path, today=None):
     """
     Process tasks from the current weekly note to the new one.
     This handles pending tasks and future tasks, and removes them from the current note.
+    Both notes are updated with update_note, so edits made to them meanwhile
+    (by the user or an overlapping --daily run) are merged instead of lost.
     """
     current_note_path = Path(current_note_path)
     new_note_path = Path(new_note_path)
-    
-    # read the content of both notes
-    current_content = current_note_path.read_text(encoding="utf-8")
-    new_content = new_note_path.read_text(encoding="utf-8")
-    
-    # parse the current note into sections
-    header, day_sections = parse_day_sections(current_content)
-    
+    if today is None:
+        today = clock.today()
+
+    # read and parse the current note once
+    with span("parse_note"):
+        current_note = load_note(current_note_path, today)
+
     # extract pending tasks (uncompleted tasks from past or present days)
-    pending_tasks = extract_pending_tasks(day_sections)
-    
+    pending_tasks = extract_pending_tasks(current_note, today)
+
     # extract future tasks (tasks scheduled for future days)
-    future_tasks = extract_future_tasks(day_sections)
-    
-    # update new note with the pending and future tasks
-    updated_new_content = update_note_with_tasks(new_content, pending_tasks, future_tasks)
-    
-    # remove pending and future tasks from the current note
-    updated_current_content = remove_tasks_from_note(current_content, pending_tasks, future_tasks)
-    
-    # write the updated content to both notes
-    new_note_path.write_text(updated_new_content, encoding="utf-8")
-    current_note_path.write_text(updated_current_content, encoding="utf-8")
-    
+    future_tasks = extract_future_tasks(current_note, today)
+    count(
+        pending_tasks=len(pending_tasks),
+        future_tasks=sum(len(info["tasks"]) for info in future_tasks.values())
+    )
+
+    # the moved tasks by day and text, to remove them again from a newer version of the note
+    moved_tasks = index_moved_tasks(current_note, pending_tasks)
+
+    with span("write_notes"):
+        # update new note with the pending and future tasks (first: stopping halfway duplicates tasks, never loses them)
+        update_note(new_note_path, lambda note: update_note_with_tasks(note, pending_tasks, future_tasks), today)
+
+        # remove pending and future tasks from the current note
+        update_note(
+            current_note_path,
+            lambda note: remove_tasks_from_note(note, find_moved_tasks(note, moved_tasks, today), {}, today),
+            today,
+            note=current_note
+        )
+
     log_action(f"Processed tasks from {current_note_path} to {new_note_path}")
     return str(new_note_path)
 
 
-def remove_tasks_from_note(content, pending_tasks, future_tasks):
+def remove_tasks_from_note(note, pending_tasks, future_tasks, today):
     """
-    Remove pending tasks and complete future day sections from the note content.
+    Remove pending tasks and complete future day sections from the note.
+    Tasks are matched by block identity, so an identical task line written on
+    another day is left alone.
     """
-    # parse the note into sections
-    header, day_sections = parse_day_sections(content)
-    
-    # create a set of task texts for easy lookup
-    task_texts = set()
-    for task_block in pending_tasks:
-        for task_line in task_block:
-            task_texts.add(task_line.strip())
-    
-    # track which day sections are for future days
-    future_day_sections = set()
-    for date, info in future_tasks.items():
-        # add the section header to our list of future days
-        for section_header in day_sections.keys():
-            if date in section_header:
-                future_day_sections.add(section_header)
-                break
-        
-        # add all task texts from future days to the removal set
-        for task_block in info["tasks"]:
-            for task_line in task_block:
-                task_texts.add(task_line.strip())
-    
+    # index the moved blocks by identity for constant-time lookups
+    moved_blocks = {id(task_block) for task_block in pending_tasks}
+    for info in future_tasks.values():
+        moved_blocks.update(id(task_block) for task_block in info["tasks"])
+
+    # future day sections were moved to the new note as a whole
+    note.sections = [section for section in note.sections if not section.is_future(today)]
+
     # remove pending tasks from each day's content
-    for day_header, day_content in list(day_sections.items()):
-        # if this is a future day section, remove it completely
-        if day_header in future_day_sections or is_future_date(day_header):
-            del day_sections[day_header]
-            continue
-            
-        if not day_content:
+    for section in note.sections:
+        section.body = [entry for entry in section.body if id(entry) not in moved_blocks]
+
+    return note
+
+
+def index_moved_tasks(note, pending_tasks):
+    """Count the pending tasks by the date of their section and their lines."""
+    pending_ids = {id(task_block) for task_block in pending_tasks}
+    moved_tasks = {}
+    for section in note.sections:
+        for task_block in section.tasks:
+            if id(task_block) in pending_ids:
+                moved_tasks.setdefault(section.date, Counter())[tuple(task_block.lines)] += 1
+    return moved_tasks
+
+
+def find_moved_tasks(note, moved_tasks, today):
+    """Return the task blocks of a (possibly newer) version of the note that were moved."""
+    remaining = {date: Counter(lines) for date, lines in moved_tasks.items()}
+    found = []
+    for section in note.sections:
+        counter = remaining.get(section.date)
+        if counter is None or section.is_future(today):
             continue
-            
-        lines = day_content.splitlines()
-        updated_lines = []
-        
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
-            
-            # check if this line is in the task_texts set
-            if line in task_texts:
-                # skip this line and any indented lines that follow
-                i += 1
-                while i < len(lines) and (lines[i].startswith('    ') or 
-                                         lines[i].strip().startswith('  - ') or 
-                                         lines[i].strip().startswith('    * ')):
-                    i += 1
-            else:
-                updated_lines.append(lines[i])
-                i += 1
-                
-        day_sections[day_header] = "\n".join(updated_lines)
-    
-    # reconstruct the note content
-    new_content = header + "\n\n"
-    for section_header, section_content in day_sections.items():
-        new_content += section_header + "\n" + section_content.strip() + "\n\n"
-    
-    return new_content
-
-
-def extract_pending_tasks(day_sections):
+        for task_block in section.tasks:
+            key = tuple(task_block.lines)
+            if counter[key] > 0:
+                counter[key] -= 1
+                found.append(task_block)
+    return found
+
+
+def extract_pending_tasks(note, today):
     """
     Extract pending (uncompleted) tasks from day sections.
     Returns a list of tasks with their hierarchies preserved.
     """
     pending_tasks = []
-    today = datetime.now().date()
-    
-    for header, content in day_sections.items():
+
+    for section in note.sections:
         # skip future days
-        if is_future_date(header):
+        if section.is_future(today):
             continue
-            
-        # find all tasks in this section
-        task_blocks = extract_task_blocks(content)
-        
+
         # add incomplete tasks to pending list
-        for task_block in task_blocks:
-            if "- [x]" not in task_block[0]:  # only if parent task is not completed
+        for task_block in section.tasks:
+            if not task_block.completed:  # only if parent task is not completed
                 pending_tasks.append(task_block)
-                
+
     return pending_tasks
 
 
-def extract_future_tasks(day_sections):
+def extract_future_tasks(note, today):
     """
     Extract tasks scheduled for future days.
     Returns a dictionary mapping day dates to tasks.
     """
     future_tasks = {}
-    
-    for header, content in day_sections.items():
+
+    for section in note.sections:
         # only process future days
-        if not is_future_date(header):
-            continue
-            
-        # extract weekday and date
-        weekday, date = extract_day_date(header)
-        if not date:
+        if not section.is_future(today):
             continue
-            
-        # find all tasks in this section
-        task_blocks = extract_task_blocks(content)
-        
+
         # add tasks to future tasks dictionary
+        task_blocks = section.tasks
         if task_blocks:
-            future_tasks[date] = {
-                "header": f"{weekday} ({date})",  # without "###" prefix
+            future_tasks[section.date] = {
+                "header": f"{section.weekday} ({section.date})",  # without "###" prefix
+                "weekday": section.weekday,
+                "day": section.day,
                 "tasks": task_blocks
             }
-                
+
     return future_tasks
 
 
-def extract_task_blocks(content):
-    """
-    Extract task blocks (tasks with their subtasks) from content.
-    A task block is a list where the first element is the parent task
-    and subsequent elements are indented subtasks.
-    """
-    task_blocks = []
-    lines = content.splitlines()
-    i = 0
-    
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        # check if this is a task line
-        if line.startswith('- ['):
-            # start a new task block
-            task_block = [line]
-            i += 1
-            
-            # look for subtasks (indented lines)
-            while i < len(lines):
-                next_line = lines[i].strip()
-                
-                # if line is indented or starts with a bullet point, it's a subtask
-                if (lines[i].startswith('    ') or 
-                    next_line.startswith('  - ') or 
-                    next_line.startswith('    * ')):
-                    task_block.append(lines[i])
-                    i += 1
-                else:
-                    break
-                    
-            task_blocks.append(task_block)
-        else:
-            i += 1
-            
-    return task_blocks
-
-
-def update_daily_tasks(weekly_note_path, calendar_events):
+def update_daily_tasks(weekly_note_path, calendar_events, note=None, today=None):
     """
     Update the weekly note with daily events from Google Calendar.
+    A note already parsed from weekly_note_path can be passed to skip reading it again.
     """
-    weekly_note_path = Path(weekly_note_path)
-    content = weekly_note_path.read_text(encoding="utf-8")
-    
-    # parse the note into sections
-    header, day_sections = parse_day_sections(content)
-    
-    # for each day section, add calendar events as tasks
-    for day_header, day_content in day_sections.items():
-        weekday, date = extract_day_date(day_header)
-        
-        if not weekday:
-            continue
-            
-        # look for calendar events for this day
-        if weekday in calendar_events:
-            events = calendar_events[weekday]
-            
-            # check if events already exist in the day content
-            updated_content = add_calendar_events_to_day(day_content, events)
-            
-            # update the section with new content
-            day_sections[day_header] = updated_content
-    
-    # reconstruct the note content
-    new_content = header + "\n\n"
-    for section_header, section_content in day_sections.items():
-        new_content += section_header + "\n" + section_content + "\n\n"
-    
-    # write the updated content back to the file
-    weekly_note_path.write_text(new_content, encoding="utf-8")
-    
-    log_action(f"Updated daily tasks in {weekly_note_path}")
+    def add_events(note):
+        # index the tasks generated from calendar events by event id
+        event_index = index_event_tasks(note)
+        seen_events = set()
+
+        # for each day section, add calendar events as tasks
+        for section in note.sections:
+            if section.weekday in calendar_events:
+                add_calendar_events_to_day(section, calendar_events[section.weekday], event_index, seen_events)
+
+        # events that are gone from the calendar (cancelled or declined) get struck through
+        strike_missing_events(event_index, seen_events)
+
+    # written back only if an event changed it, merged with edits made meanwhile
+    with span("update_note"):
+        update_note(weekly_note_path, add_events, today, note=note)
+
     return str(weekly_note_path)
 
 
-def add_calendar_events_to_day(day_content, events):
+def add_calendar_events_to_day(section, events, event_index=None, seen_events=None):
     """
     Add calendar events to a day section, avoiding duplicates.
+    Tasks carry a hidden event id/etag marker: an event that changed (or moved
+    from another day) rewrites its existing task in place instead of adding a new one.
     """
-    lines = day_content.splitlines()
-    
-    # extract existing event texts to avoid duplicates
-    existing_events = []
-    for line in lines:
-        if line.strip().startswith("- ["):
-            # extract text part after checkbox
-            event_text = line.split("] ", 1)[-1].strip()
-            existing_events.append(event_text)
-    
-    # add new events if they don't already exist
+    if event_index is None:
+        event_index = {}
+
+    # tasks without a marker are matched by text (added before markers existed)
+    unmarked_tasks = {}
+    for task_block in section.tasks:
+        if not EVENT_MARKER_PATTERN.search(task_block.task):
+            unmarked_tasks.setdefault(task_block.task.split("] ", 1)[-1].strip(), task_block)
+
     for event in events:
-        summary = event['summary']
-        start_time = event['start'].strftime('%H:%M')
-        end_time = event['end'].strftime('%H:%M')
-        
-        event_text = f"{summary} | {start_time} - {end_time}"
-        
-        if event_text not in existing_events:
-            lines.append(f"- [ ] {event_text}")
-            log_action(f"Added new event: {event_text}")
-    
-    return "\n".join(lines)
-
-
-def update_note_with_tasks(content, pending_tasks, future_tasks):
+        event_id = event.id
+        event_text = format_event_text(event)
+        if seen_events is not None:
+            seen_events.add(event_id)
+
+        if not event_id:
+            if event_text not in unmarked_tasks:
+                unmarked_tasks[event_text] = add_event_task(section, event_text)
+            continue
+
+        marker = format_event_marker(event)
+        indexed = event_index.get(event_id)
+
+        if indexed is None:
+            task_block = unmarked_tasks.pop(event_text, None)
+            if task_block is not None:
+                # adopt the old task by giving it a marker
+                task_block.lines[0] = task_block.task.rstrip() + marker
+            else:
+                task_block = add_event_task(section, event_text, marker)
+            event_index[event_id] = (section, task_block)
+            continue
+
+        # unchanged events are left alone (even if the task text was edited)
+        owner, task_block = indexed
+        checkbox, text, _ = split_event_task(task_block.task)
+        if owner is section and task_block.task.endswith(marker) and not text.startswith("~~"):
+            continue
+
+        task_block.lines[0] = f"{checkbox} {event_text}{marker}"
+        if owner is not section:
+            owner.body.remove(task_block)
+            section.body.append(task_block)
+            event_index[event_id] = (section, task_block)
+        log_action(f"Updated event: {event_text}")
+
+    return section
+
+
+def add_event_task(section, event_text, marker=""):
+    """Append a new event task to a section and return its block."""
+    task_block = TaskBlock([f"- [ ] {event_text}{marker}"])
+    section.body.append(task_block)
+    log_action(f"Added new event: {event_text}")
+    return task_block
+
+
+def index_event_tasks(note):
+    """Map the event id of every marked task in the note to its section and block."""
+    event_index = {}
+    for section in note.sections:
+        for task_block in section.tasks:
+            match = EVENT_MARKER_PATTERN.search(task_block.task)
+            if match:
+                event_index[match.group(1)] = (section, task_block)
+    return event_index
+
+
+def strike_missing_events(event_index, seen_events):
+    """Strike through open tasks whose events were not returned by the calendar anymore."""
+    for event_id, (section, task_block) in event_index.items():
+        if event_id in seen_events or task_block.completed:
+            continue
+
+        checkbox, text, marker = split_event_task(task_block.task)
+        if text.startswith("~~"):
+            continue
+
+        task_block.lines[0] = f"{checkbox} ~~{text}~~{marker}"
+        log_action(f"Struck cancelled event: {text}")
+
+
+def format_event_text(event):
+    """Format an event as "summary | HH:MM - HH:MM"."""
+    start_time = event.start.strftime('%H:%M')
+    end_time = event.end.strftime('%H:%M')
+    return f"{event.summary} | {start_time} - {end_time}"
+
+
+def format_event_marker(event):
+    """Build the hidden marker with the event id and its (unquoted) etag."""
+    etag = (event.etag or '').strip('"')
+    return f" <!-- gcal:{event.id} {etag} -->"
+
+
+def split_event_task(task_line):
+    """Split a task line into its checkbox, its text and its event marker."""
+    checkbox, _, rest = task_line.partition("] ")
+    match = EVENT_MARKER_PATTERN.search(rest)
+    marker = match.group(0) if match else ""
+    text = rest[:match.start()] if match else rest
+    return f"{checkbox}]", text.strip(), marker
+
+
+def carry_over_copy(task_block):
+    """Copy a task into another note; event markers only make sense within their own week."""
+    copied = task_block.copy()
+    copied.lines[0] = EVENT_MARKER_PATTERN.sub("", copied.task)
+    return copied
+
+
+def update_note_with_tasks(note, pending_tasks, future_tasks):
     """
-    Update the weekly note content with pending and future tasks.
+    Update the weekly note with pending and future tasks.
     """
-    # parse the note into sections
-    header, day_sections = parse_day_sections(content)
-    
     # find the Monday section to add pending tasks
-    monday_section = None
-    for section_header in day_sections.keys():
-        if "Monday" in section_header:
-            monday_section = section_header
-            break
-    
-    if monday_section:
-        # add pending tasks after "Organizar tarefas semanais"
-        lines = day_sections[monday_section].splitlines()
-        new_lines = []
-        
-        for line in lines:
-            new_lines.append(line)
-            if "Organizar tarefas semanais" in line:
-                # add pending tasks right after this line
-                for task_block in pending_tasks:
-                    new_lines.extend(task_block)
-                
-        day_sections[monday_section] = "\n".join(new_lines)
-    
+    monday_section = next(
+        (section for section in note.sections if section.weekday == "Monday"), None
+    )
+
+    if monday_section and pending_tasks:
+        # add pending tasks after "Organizar tarefas semanais" (or at the end of Monday)
+        position = len(monday_section.body)
+        for index, entry in enumerate(monday_section.body):
+            if isinstance(entry, TaskBlock) and "Organizar tarefas semanais" in entry.task:
+                position = index + 1
+                break
+
+        monday_section.body[position:position] = [carry_over_copy(task_block) for task_block in pending_tasks]
+
     # add future tasks to their corresponding days
+    sections_by_date = note.sections_by_date()
     for date, info in future_tasks.items():
-        target_section = None
-        
-        # find the section with matching date
-        for section_header in day_sections.keys():
-            if date in section_header:
-                target_section = section_header
-                break
-        
-        if target_section:
-            # add tasks to existing section
-            current_content = day_sections[target_section]
-            task_content = "\n".join(["\n".join(task_block) for task_block in info["tasks"]])
-            day_sections[target_section] = current_content + "\n" + task_content
-        else:
+        target_section = sections_by_date.get(date)
+
+        if target_section is None:
             # create new section with proper header formatting
-            header_text = f"### {info['header']}"
-            day_sections[header_text] = "\n".join(["\n".join(task_block) for task_block in info["tasks"]])
-    
-    # reconstruct the note content
-    new_content = header + "\n\n"
-    for section_header, section_content in day_sections.items():
-        new_content += section_header + "\n" + section_content + "\n\n"
-    
-    return new_content
+            target_section = DaySection(f"### {info['header']}", info["weekday"], date, info["day"])
+            note.sections.append(target_section)
+            sections_by_date[date] = target_section
+
+        target_section.body.extend(carry_over_copy(task_block) for task_block in info["tasks"])
+
+    return note
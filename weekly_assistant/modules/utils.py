@@ -1,17 +1,24 @@
 #!/usr/bin/env python
 
 import os
-import re
-from pathlib import Path
 from datetime import datetime
+from modules import instrument
 
-def setup_paths():
-    """Set up the paths needed for the application."""
+def setup_paths(vault=None):
+    """
+    Set up the paths needed for the application.
+    A vault entry from a batch config overrides the inbox and archive dirs and
+    keeps its token, event store, task index and note cache under its own state dir.
+    """
     base_dir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
     
     paths = {
         "base_dir": base_dir,
-        "calendar_path": os.path.join(base_dir, "calendar/google_calendar.md"),
+        "snapshot_path": os.path.join(base_dir, "calendar/snapshot.jsonl"),
+        "event_store_path": os.path.join(base_dir, "calendar/events.db"),
+        "calendar_window_path": os.path.join(base_dir, "calendar/window.json"),
+        "index_path": os.path.join(base_dir, "index/tasks.db"),
+        "note_cache_dir": os.path.join(base_dir, "cache/notes"),
         "token_path": os.path.join(base_dir, "config/token.json"),
         "credentials_path": os.path.join(base_dir, "config/credentials.json"),
         #"inbox_dir": os.path.join(base_dir, "inbox/"),                 # debug inbox dir 
@@ -20,73 +27,32 @@ def setup_paths():
         "archive_dir": "/home/felipevzps/obsidian/workspace/archive/"   # my valt archive 
     }
     
+    if vault:
+        state_dir = vault.get("state_dir", os.path.join(base_dir, "vaults", vault["name"]))
+        paths.update({
+            "snapshot_path": os.path.join(state_dir, "calendar/snapshot.jsonl"),
+            "event_store_path": os.path.join(state_dir, "calendar/events.db"),
+            "calendar_window_path": os.path.join(state_dir, "calendar/window.json"),
+            "index_path": os.path.join(state_dir, "index/tasks.db"),
+            "note_cache_dir": os.path.join(state_dir, "cache/notes"),
+            "token_path": vault.get("token_path", os.path.join(state_dir, "config/token.json")),
+            "credentials_path": vault.get("credentials_path", paths["credentials_path"]),
+            "inbox_dir": vault["inbox_dir"],
+            "archive_dir": vault["archive_dir"]
+        })
+    
     # create directories if they don't exist
-    for path_key in ["calendar_path"]:
+    for path_key in ["snapshot_path", "index_path", "token_path"]:
         os.makedirs(os.path.dirname(paths[path_key]), exist_ok=True)
     
     return paths
 
 
-def parse_day_sections(content):
-    """
-    Parse a markdown file into day sections.
-    Returns a dictionary mapping day headers to their content.
-    """
-    day_pattern = r"(### \w+ \(\d{2}/\d{2}\).*?)(?=### |\Z)"
-    day_sections = {}
-    
-    # extract the headers and content before any day section
-    header_match = re.split(r"(?=^### .+)", content, maxsplit=1, flags=re.MULTILINE)
-    header = header_match[0].strip() if header_match else ""
-    
-    # extract day sections
-    for match in re.finditer(day_pattern, content, re.DOTALL | re.MULTILINE):
-        section = match.group(1).strip()
-        lines = section.splitlines()
-        if not lines:
-            continue
-            
-        day_title = lines[0]
-        day_content = "\n".join(lines[1:]) if len(lines) > 1 else ""
-        day_sections[day_title] = day_content
-    
-    return header, day_sections
-
-
-def is_future_date(date_str):
-    """Check if a date string (DD/MM) is in the future."""
-    today = datetime.now().date()
-    
-    # extract day and month from the string
-    match = re.search(r"(\d{2})/(\d{2})", date_str)
-    if not match:
-        return False
-        
-    day = int(match.group(1))
-    month = int(match.group(2))
-    
-    # assume current year (might need adjustment for dates spanning year boundary)
-    year = today.year
-    
-    try:
-        date = datetime(year, month, day).date()
-        return date > today
-    except ValueError:
-        # invalid date
-        return False
-
-
-def extract_day_date(header):
-    """Extract weekday and date from a section header."""
-    match = re.match(r"### (\w+) \((\d{2}/\d{2})\)", header)
-    if match:
-        weekday, date = match.groups()
-        return weekday, date
-    return None, None
-
-
 def log_action(message):
-    """Log an action with timestamp."""
+    """Log an action with timestamp (a JSON line when --log-json is on)."""
+    if instrument.enabled():
+        instrument.log(message)
+        return
     now = datetime.now()
     timestamp = now.strftime("%d/%m/%Y - %H:%M:%S")
     print(f"[{timestamp}] {message}")
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+
+import time
+import datetime
+from modules.calendar_window import organize_events
+
+
+def all_day_event(day):
+    return {
+        "id": f"holiday-{day}",
+        "summary": "Holiday",
+        "start": {"date": day.isoformat()},
+        "end": {"date": (day + datetime.timedelta(days=1)).isoformat()}
+    }
+
+
+def test_all_day_events_stay_on_their_day_whatever_the_host_timezone(monkeypatch):
+    # a host in UTC with notes in Sao Paulo (UTC-3) used to put Tuesday's event on Monday at 21:00
+    monkeypatch.setenv("TZ", "UTC")
+    time.tzset()
+    try:
+        days = organize_events([all_day_event(datetime.date(2026, 10, 13))], "America/Sao_Paulo")
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+    [event] = days["Tuesday"]
+    assert (event.start.date(), event.start.hour) == (datetime.date(2026, 10, 13), 0)
+    assert event.end.date() == datetime.date(2026, 10, 14)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+import random
+import datetime
+import pytest
+from modules.recurrence import expand_master, UnsupportedRecurrence
+
+UTC = datetime.timezone.utc
+
+# rules compared against dateutil, and how many of them must be expandable here
+RANDOM_RULES = 3000
+MIN_COMPARED = 2000
+
+WEEKDAY_NAMES = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+
+
+def all_day_master(start, rule):
+    """An all-day recurring event starting on start (a date)."""
+    return {
+        "id": "series",
+        "summary": "Series",
+        "start": {"date": start.isoformat()},
+        "end": {"date": (start + datetime.timedelta(days=1)).isoformat()},
+        "recurrence": [f"RRULE:{rule}"]
+    }
+
+
+def expanded_days(start, rule, first_day, last_day):
+    """The days of the instances expand_master returns for [first_day, last_day)."""
+    window_start = datetime.datetime.combine(first_day, datetime.time(), UTC)
+    window_end = datetime.datetime.combine(last_day, datetime.time(), UTC)
+    instances = expand_master(all_day_master(start, rule), window_start, window_end)
+    return [datetime.date.fromisoformat(instance["start"]["date"]) for instance in instances]
+
+
+def random_rule(rng):
+    """
+    A random RRULE using the parts recurrence.py expands. Rules that can
+    never select a day (BYMONTHDAY=31;BYMONTH=4) are left out: dateutil
+    searches them until year 9999.
+    """
+    freq = rng.choice(("DAILY", "WEEKLY", "MONTHLY", "YEARLY"))
+    parts = [f"FREQ={freq}"]
+    by_month = rng.random() < 0.3
+    # a monthly interval can step over every month BYMONTH allows
+    if rng.random() < 0.4 and not (freq == "MONTHLY" and by_month):
+        parts.append(f"INTERVAL={rng.randint(2, 4)}")
+
+    numbered = False
+    if rng.random() < 0.5:
+        weekdays = rng.sample(WEEKDAY_NAMES, rng.randint(1, 3))
+        if freq in ("MONTHLY", "YEARLY") and rng.random() < 0.5:
+            weekdays = [f"{rng.choice((1, 2, 3, 4, -1))}{weekday}" for weekday in weekdays]
+            numbered = True
+        parts.append(f"BYDAY={','.join(weekdays)}")
+    # BYMONTHDAY isn't allowed in weekly rules (RFC 5545), and with numbered weekdays it rarely selects a day
+    if freq != "WEEKLY" and not numbered and rng.random() < 0.4:
+        numbers = (1, 10, 15, 28, -1) if by_month else (1, 10, 15, 28, 30, 31, -1)
+        parts.append(f"BYMONTHDAY={','.join(str(rng.choice(numbers)) for _ in range(rng.randint(1, 2)))}")
+    if by_month:
+        parts.append(f"BYMONTH={','.join(str(month) for month in sorted(rng.sample(range(1, 13), rng.randint(1, 3))))}")
+    if freq == "WEEKLY" and rng.random() < 0.3:
+        parts.append(f"WKST={rng.choice(WEEKDAY_NAMES)}")
+
+    limit = rng.random()
+    if limit < 0.3:
+        parts.append(f"COUNT={rng.randint(1, 30)}")
+    elif limit < 0.5:
+        parts.append(f"UNTIL={datetime.date(2026, 1, 1) + datetime.timedelta(days=rng.randint(0, 900)):%Y%m%d}")
+    return ";".join(parts)
+
+
+def test_yearly_by_month_day_repeats_every_month():
+    days = expanded_days(datetime.date(2026, 3, 1), "FREQ=YEARLY;BYMONTHDAY=1", datetime.date(2026, 3, 1), datetime.date(2026, 7, 1))
+    assert days == [datetime.date(2026, month, 1) for month in range(3, 7)]
+
+
+def test_yearly_by_day_without_by_month_is_left_to_the_server():
+    with pytest.raises(UnsupportedRecurrence):
+        expanded_days(datetime.date(2026, 1, 5), "FREQ=YEARLY;BYDAY=20MO", datetime.date(2026, 1, 1), datetime.date(2026, 12, 31))
+
+
+def test_matches_dateutil():
+    rrule = pytest.importorskip("dateutil.rrule")
+    rng = random.Random(2026)
+
+    compared = 0
+    for _ in range(RANDOM_RULES):
+        rule = random_rule(rng)
+        # the series starts on its first occurrence: dtstart always counts as
+        # one for Google, while dateutil skips a dtstart the rule doesn't select
+        requested = datetime.datetime(2026, 1, 1) + datetime.timedelta(days=rng.randint(0, 365))
+        search = rrule.rrulestr(rule, dtstart=requested).replace(count=None, until=requested + datetime.timedelta(days=730))
+        first = search.after(requested, inc=True)
+        if first is None:
+            continue
+        expected_rule = rrule.rrulestr(rule, dtstart=first)
+        if expected_rule.between(first, first, inc=True) != [first]:
+            continue
+
+        first_day = first.date() + datetime.timedelta(days=rng.randint(-30, 700))
+        last_day = first_day + datetime.timedelta(days=rng.randint(1, 120))
+        try:
+            days = expanded_days(first.date(), rule, first_day, last_day)
+        except UnsupportedRecurrence:
+            continue
+
+        window_start = datetime.datetime.combine(first_day, datetime.time())
+        window_end = datetime.datetime.combine(last_day, datetime.time())
+        expected = [moment.date() for moment in expected_rule.between(window_start, window_end, inc=True) if moment < window_end]
+        assert days == expected, f"{rule} from {first.date()} in [{first_day}, {last_day})"
+        compared += 1
+
+    assert compared >= MIN_COMPARED